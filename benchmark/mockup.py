@@ -0,0 +1,334 @@
+"""Helpers to measure the XTZFA2Swap contract in an octez-client mockup.
+
+SmartPy CLI compiles the contracts and the parameters of every call to
+Michelson, and octez-client runs the calls in a mockup to report the consumed
+gas, the paid storage and the internal operations of each of them.
+"""
+
+import glob
+import os
+import re
+import subprocess
+import tempfile
+
+
+# The repository root, SmartPy resolves the imported scripts from there
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The two FA2 implementations the tests trade with
+MOCKS = ("fa2", "fa2TestContract")
+
+# The swap contract compiled as the monolithic, lazy entry point and pulled
+# royalty variants, see the compilation targets of the contract
+VARIANTS = ("swap", "swap_lazy", "swap_pull")
+
+# Parameter types of the FA2 entry points, both mocks force right combs
+FA2_TRANSFER_TYPE = """sp.TList(sp.TRecord(
+    from_=sp.TAddress,
+    txs=sp.TList(sp.TRecord(
+        to_=sp.TAddress,
+        token_id=sp.TNat,
+        amount=sp.TNat).layout(("to_", ("token_id", "amount"))))).layout(
+            ("from_", "txs")))"""
+
+FA2_UPDATE_OPERATORS_TYPE = """sp.TList(sp.TVariant(
+    add_operator=sp.TRecord(
+        owner=sp.TAddress,
+        operator=sp.TAddress,
+        token_id=sp.TNat).layout(("owner", ("operator", "token_id"))),
+    remove_operator=sp.TRecord(
+        owner=sp.TAddress,
+        operator=sp.TAddress,
+        token_id=sp.TNat).layout(("owner", ("operator", "token_id")))))"""
+
+FA2_MINT_TYPES = {
+    "fa2": "sp.TRecord(amount=sp.TNat)",
+    "fa2TestContract": """sp.TRecord(
+    address=sp.TAddress,
+    amount=sp.TNat,
+    metadata=sp.TMap(sp.TString, sp.TBytes),
+    token_id=sp.TNat)""",
+}
+
+# The contracts of the compilation script, one per target
+CONTRACTS_SCRIPT = """import smartpy as sp
+
+swap = sp.io.import_script_from_url("file:contracts/xtzfa2swap.py")
+fa2 = sp.io.import_script_from_url("file:fa2-mocks/fa2.py")
+fa2TestContract = sp.io.import_script_from_url("file:fa2-mocks/fa2TestContract.py")
+
+sp.add_compilation_target("bench_swap", swap.XTZFA2Swap(
+    administrator=sp.address("{admin}")))
+sp.add_compilation_target("bench_swap_lazy", swap.XTZFA2Swap(
+    administrator=sp.address("{admin}"),
+    lazy_entry_points=True))
+sp.add_compilation_target("bench_swap_pull", swap.XTZFA2Swap(
+    administrator=sp.address("{admin}"),
+    pull_royalties=True))
+sp.add_compilation_target("bench_fa2", fa2.FA2(
+    administrator=sp.address("{admin}"),
+    metadata=sp.utils.metadata_of_url("ipfs://aaa")))
+sp.add_compilation_target("bench_fa2TestContract", fa2TestContract.FA2(
+    config=fa2TestContract.FA2_config(),
+    admin=sp.address("{admin}"),
+    metadata=sp.utils.metadata_of_url("ipfs://bbb")))
+"""
+
+EXPRESSIONS_SCRIPT_HEADER = """import smartpy as sp
+
+swap = sp.io.import_script_from_url("file:contracts/xtzfa2swap.py")
+"""
+
+
+class MockupError(Exception):
+    """Raised when octez-client or SmartPy CLI fails."""
+
+
+def run(command, cwd=ROOT):
+    """Runs a command and returns its output, failing with its output when
+    the command fails.
+    """
+    process = subprocess.run(
+        command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        universal_newlines=True)
+    if process.returncode != 0:
+        raise MockupError("{} failed:\n{}".format(" ".join(command), process.stdout))
+    return process.stdout
+
+
+def search(pattern, output, what):
+    """Returns the first group of a pattern in a command output, failing with
+    the output when the pattern is missing, so a change in the output format
+    can't go unnoticed.
+    """
+    match = re.search(pattern, output)
+    if match is None:
+        raise MockupError("Could not find the {} in:\n{}".format(what, output))
+    return match.group(1)
+
+
+def tez(mutez):
+    """Formats a mutez amount the way octez-client expects tez."""
+    return "{}.{:06d}".format(mutez // 1000000, mutez % 1000000)
+
+
+def parse_receipt(output):
+    """Returns the cost of an operation from its octez-client receipt. Gas and
+    paid storage are summed over the operation and its internal operations.
+    """
+    gas = re.findall(r"Consumed gas: ([\d.]+)", output)
+    if not gas:
+        raise MockupError("Could not find the consumed gas in:\n{}".format(output))
+    return {
+        "gas": round(sum(float(value) for value in gas), 3),
+        "storage_diff": sum(int(size) for size in re.findall(r"Paid storage size diff: (-?\d+) bytes", output)),
+        "internal_operations": len(re.findall(r"Internal (?:Transaction|Origination|Delegation):", output)),
+        "events": len(re.findall(r"Internal Event:", output)),
+    }
+
+
+class SmartPy:
+    """Compiles contracts and Michelson expressions with SmartPy CLI."""
+
+    def __init__(self, cli, output_dir):
+        self.cli = os.path.expanduser(cli)
+        self.output_dir = output_dir
+
+    def compile(self, name, script):
+        """Compiles a SmartPy script and returns its output directory."""
+        output_dir = os.path.join(self.output_dir, name)
+        os.makedirs(output_dir, exist_ok=True)
+        script_path = os.path.join(output_dir, "script.py")
+        with open(script_path, "w") as script_file:
+            script_file.write(script)
+        run([self.cli, "compile", script_path, output_dir, "--purge"])
+        return output_dir
+
+    def contract(self, output_dir, target):
+        """Returns the code path and initial storage of a compiled contract."""
+        prefix = os.path.join(output_dir, target, "step_000_cont_0_")
+        if not os.path.exists(prefix + "contract.tz"):
+            raise MockupError("SmartPy CLI did not compile the {} contract, found {}".format(
+                target, sorted(glob.glob(os.path.join(output_dir, target, "*")))))
+        with open(prefix + "storage.tz") as storage_file:
+            return prefix + "contract.tz", storage_file.read().strip()
+
+    def expression(self, output_dir, target):
+        """Returns a compiled expression as Michelson."""
+        paths = sorted(glob.glob(os.path.join(output_dir, target, "*expression*.tz")))
+        if not paths:
+            raise MockupError("SmartPy CLI did not compile the {} expression".format(target))
+        with open(paths[0]) as expression_file:
+            return expression_file.read().strip()
+
+
+class Mockup:
+    """An octez-client mockup with its own base directory."""
+
+    def __init__(self, octez_client="octez-client", base_dir=None):
+        self.octez_client = octez_client
+        self.base_dir = base_dir or tempfile.mkdtemp(prefix="xtzfa2swap-mockup-")
+        self.client("create", "mockup")
+
+    def client(self, *args):
+        """Runs an octez-client command in the mockup."""
+        return run([self.octez_client, "--mode", "mockup", "--base-dir", self.base_dir] + list(args))
+
+    def address(self, alias):
+        """Returns the address of a known account or contract."""
+        output = self.client("show", "address", alias)
+        return search(r"Hash: (tz\w+)", output, "address of " + alias)
+
+    def gen_account(self, alias):
+        """Generates a key pair and returns its address."""
+        self.client("gen", "keys", alias, "--force")
+        return self.address(alias)
+
+    def originate(self, alias, code_path, storage):
+        """Originates a contract and returns its address."""
+        output = self.client(
+            "originate", "contract", alias, "transferring", "0", "from", "bootstrap1",
+            "running", code_path, "--init", storage, "--burn-cap", "100", "--force")
+        return search(r"New contract (KT1\w+) originated", output, "address of " + alias)
+
+    def call(self, sender, contract, entrypoint, arg, mutez=0):
+        """Calls a contract entry point and returns the cost of the call."""
+        output = self.client(
+            "transfer", tez(mutez), "from", sender, "to", contract,
+            "--entrypoint", entrypoint, "--arg", arg, "--burn-cap", "100")
+        return parse_receipt(output)
+
+
+def address(value):
+    return 'sp.address("{}")'.format(value)
+
+
+def token(fa2, token_id, royalty_addresses):
+    """Returns the SmartPy source of a TOKEN_TYPE record."""
+    return "sp.record(fa2={}, id=sp.nat({}), amount=sp.nat(1), royalty_addresses=sp.list([{}], t=sp.TAddress))".format(
+        address(fa2), token_id, ", ".join(address(a) for a in royalty_addresses))
+
+
+def trade_proposal(proposer, acceptor, mutez1, mutez2, tokens1, tokens2):
+    """Returns the SmartPy source of a TRADE_PROPOSAL_TYPE record."""
+    return """sp.set_type_expr(sp.record(
+    proposer={},
+    acceptor={},
+    mutez_amount1=sp.mutez({}),
+    mutez_amount2=sp.mutez({}),
+    tokens1=sp.list([{}]),
+    tokens2=sp.list([{}]),
+    expires_at=sp.none,
+    divisible=False), swap.XTZFA2Swap.TRADE_PROPOSAL_TYPE)""".format(
+        address(proposer), address(acceptor), mutez1, mutez2,
+        ", ".join(tokens1), ", ".join(tokens2))
+
+
+def fa2_mint(mock, owner, token_id):
+    """Returns the SmartPy source of a mint parameter. The fa2 mock mints the
+    next token id to its administrator, the other one mints to any owner.
+    """
+    if mock == "fa2":
+        value = "sp.record(amount=sp.nat(1))"
+    else:
+        value = 'sp.record(address={}, amount=sp.nat(1), metadata={{"": sp.bytes("0x00")}}, token_id=sp.nat({}))'.format(
+            address(owner), token_id)
+    return "sp.set_type_expr({}, {})".format(value, FA2_MINT_TYPES[mock])
+
+
+def fa2_transfer(from_, to_, token_ids):
+    """Returns the SmartPy source of a transfer of one edition of each token."""
+    return "sp.set_type_expr([sp.record(from_={}, txs=[{}])], {})".format(
+        address(from_),
+        ", ".join("sp.record(to_={}, token_id=sp.nat({}), amount=sp.nat(1))".format(address(to_), i) for i in token_ids),
+        FA2_TRANSFER_TYPE)
+
+
+def fa2_add_operators(owner, operator, token_ids):
+    """Returns the SmartPy source of an update_operators adding an operator
+    for each token.
+    """
+    return "sp.set_type_expr([{}], {})".format(
+        ", ".join('sp.variant("add_operator", sp.record(owner={}, operator={}, token_id=sp.nat({})))'.format(
+            address(owner), address(operator), i) for i in token_ids),
+        FA2_UPDATE_OPERATORS_TYPE)
+
+
+class Bench:
+    """Originates fresh contracts in a mockup and runs trades against them."""
+
+    def __init__(self, smartpy, mockup):
+        self.smartpy = smartpy
+        self.mockup = mockup
+        self.proposer = mockup.address("bootstrap1")
+        self.acceptor = mockup.address("bootstrap2")
+        self.royalty_addresses = []
+        self.contracts_dir = smartpy.compile(
+            "contracts", CONTRACTS_SCRIPT.format(admin=self.proposer))
+        self.originations = 0
+
+    def royalty_accounts(self, count):
+        """Returns the addresses of count royalty recipients."""
+        while len(self.royalty_addresses) < count:
+            self.royalty_addresses.append(
+                self.mockup.gen_account("royalty{}".format(len(self.royalty_addresses))))
+        return self.royalty_addresses[:count]
+
+    def originate(self, target):
+        """Originates a fresh instance of a compiled contract."""
+        self.originations += 1
+        code_path, storage = self.smartpy.contract(self.contracts_dir, "bench_" + target)
+        return self.mockup.originate("{}_{}".format(target, self.originations), code_path, storage)
+
+    def compile_calls(self, name, calls):
+        """Compiles the parameters of a list of (sender, contract, entrypoint,
+        SmartPy source, mutez) calls and returns them with Michelson arguments.
+        """
+        script = EXPRESSIONS_SCRIPT_HEADER + "".join(
+            '\nsp.add_expression_compilation_target("call_{}", {})\n'.format(i, call[3])
+            for i, call in enumerate(calls))
+        output_dir = self.smartpy.compile(name, script)
+        return [
+            (sender, contract, entrypoint, self.smartpy.expression(output_dir, "call_{}".format(i)), mutez)
+            for i, (sender, contract, entrypoint, _, mutez) in enumerate(calls)]
+
+    def run_calls(self, calls):
+        """Runs compiled calls and returns the cost of each of them."""
+        return [
+            self.mockup.call(sender, contract, entrypoint, arg, mutez)
+            for sender, contract, entrypoint, arg, mutez in calls]
+
+    def setup_bundles(self, name, mock, tokens, royalties, fa2_contracts, variant="swap"):
+        """Originates a swap contract of the given variant and fa2_contracts
+        FA2 contracts, gives the proposer and the acceptor tokens editions
+        spread over them, and makes the swap contract their operator. Returns
+        the swap address and the TOKEN_TYPE sources of both bundles.
+        """
+        swap = self.originate(variant)
+        fa2s = [self.originate(mock) for _ in range(fa2_contracts)]
+        royalty_addresses = self.royalty_accounts(royalties)
+
+        # Token i of each bundle lives in the FA2 contract i % fa2_contracts
+        ids = {fa2: {self.proposer: [], self.acceptor: []} for fa2 in fa2s}
+        bundles = {self.proposer: [], self.acceptor: []}
+        calls = []
+        for owner in (self.proposer, self.acceptor):
+            for i in range(tokens):
+                fa2 = fa2s[i % fa2_contracts]
+                token_id = sum(len(owned) for owned in ids[fa2].values())
+                ids[fa2][owner].append(token_id)
+                bundles[owner].append(token(fa2, token_id, royalty_addresses))
+                calls.append((self.proposer, fa2, "mint", fa2_mint(mock, owner, token_id), 0))
+
+        for fa2 in fa2s:
+            # The fa2 mock mints to its administrator, hand the acceptor tokens over
+            if mock == "fa2" and ids[fa2][self.acceptor]:
+                calls.append((self.proposer, fa2, "transfer",
+                              fa2_transfer(self.proposer, self.acceptor, ids[fa2][self.acceptor]), 0))
+            for owner in (self.proposer, self.acceptor):
+                if ids[fa2][owner]:
+                    calls.append((owner, fa2, "update_operators",
+                                  fa2_add_operators(owner, swap, ids[fa2][owner]), 0))
+
+        self.run_calls(self.compile_calls(name + "_setup", calls))
+        return swap, bundles[self.proposer], bundles[self.acceptor]
@@ -0,0 +1,232 @@
+"""Measures propose_trade, accept_trade and cancel_trade_proposal of the
+XTZFA2Swap contract over bundle sizes, royalty address counts, number of FA2
+contracts, both FA2 mocks and the monolithic, lazy entry point and pulled
+royalty variants of the contract, then propose_trades and accept_trades over
+batch sizes and every other entry point once per variant, and writes the
+results to CSV and JSON.
+
+Requires SmartPy CLI and octez-client. Run it from anywhere:
+
+    python3 benchmark/run_benchmark.py
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+
+from mockup import MOCKS, ROOT, VARIANTS, Bench, Mockup, SmartPy, trade_proposal
+
+
+# Every axis is swept on its own around the base configuration, or all of
+# them together with --full
+TOKENS = (1, 2, 5, 10, 25, 50)
+ROYALTIES = (0, 1, 2, 5, 10)
+FA2_CONTRACTS = (1, 2, 5)
+BASE = {"tokens": 1, "royalties": 0, "fa2_contracts": 1}
+
+# The number of single token trades proposed and accepted in one batch
+BATCHES = (1, 2, 5, 10, 25)
+
+# The tez each side of the benchmarked trades pays, so royalties are paid
+MUTEZ_AMOUNT = 1000000
+
+FIELDS = ("variant", "mock", "trades", "tokens", "royalties", "fa2_contracts", "entrypoint",
+          "gas", "storage_diff", "internal_operations", "events")
+
+
+def configurations(full):
+    """Returns the (variant, mock, tokens, royalties, fa2_contracts) to
+    measure.
+    """
+    if full:
+        sweep = itertools.product(TOKENS, ROYALTIES, FA2_CONTRACTS)
+    else:
+        sweep = [(tokens, BASE["royalties"], BASE["fa2_contracts"]) for tokens in TOKENS]
+        sweep += [(BASE["tokens"], royalties, BASE["fa2_contracts"]) for royalties in ROYALTIES]
+        # Spread a bundle of 5 tokens over more and more FA2 contracts
+        sweep += [(5, BASE["royalties"], fa2_contracts) for fa2_contracts in FA2_CONTRACTS]
+
+    configs = []
+    for variant, mock in itertools.product(VARIANTS, MOCKS):
+        for tokens, royalties, fa2_contracts in sweep:
+            # A bundle can't spread over more contracts than it has tokens
+            config = (variant, mock, tokens, royalties, min(fa2_contracts, tokens))
+            if config not in configs:
+                configs.append(config)
+    return configs
+
+
+def row(variant, mock, trades, tokens, royalties, fa2_contracts, entrypoint, cost):
+    """Returns a result row with the configuration and the cost of a call."""
+    result = {"variant": variant, "mock": mock, "trades": trades, "tokens": tokens,
+              "royalties": royalties, "fa2_contracts": fa2_contracts, "entrypoint": entrypoint}
+    result.update(cost)
+    return result
+
+
+def measure(bench, variant, mock, tokens, royalties, fa2_contracts):
+    """Proposes and cancels a trade, then proposes and accepts another one
+    with the same bundles. Returns the cost of each call.
+    """
+    name = "{}_{}_{}t_{}r_{}c".format(variant, mock, tokens, royalties, fa2_contracts)
+    swap, tokens1, tokens2 = bench.setup_bundles(name, mock, tokens, royalties, fa2_contracts, variant)
+
+    proposal = trade_proposal(
+        bench.proposer, swap, MUTEZ_AMOUNT, MUTEZ_AMOUNT, tokens1, tokens2)
+    calls = bench.compile_calls(name, [
+        (bench.proposer, swap, "propose_trade", proposal, MUTEZ_AMOUNT),
+        (bench.proposer, swap, "cancel_trade_proposal", "sp.nat(0)", 0),
+        (bench.proposer, swap, "propose_trade", proposal, MUTEZ_AMOUNT),
+        (bench.acceptor, swap, "accept_trade", "sp.nat(1)", MUTEZ_AMOUNT),
+    ])
+    costs = bench.run_calls(calls)
+
+    # The second proposal only sets up the accept
+    rows = []
+    for (_, _, entrypoint, _, _), cost in zip(calls, costs):
+        if entrypoint == "propose_trade" and rows:
+            continue
+        rows.append(row(variant, mock, 1, tokens, royalties, fa2_contracts, entrypoint, cost))
+    return rows
+
+
+def measure_batch(bench, variant, mock, trades):
+    """Proposes a batch of single token trades with propose_trades, then
+    accepts all of them with accept_trades. Returns the cost of each call.
+    """
+    name = "{}_{}_{}b".format(variant, mock, trades)
+    swap, tokens1, tokens2 = bench.setup_bundles(
+        name, mock, trades, BASE["royalties"], BASE["fa2_contracts"], variant)
+
+    # Trade i swaps the token i of each bundle
+    proposals = [
+        trade_proposal(bench.proposer, swap, MUTEZ_AMOUNT, MUTEZ_AMOUNT, [token1], [token2])
+        for token1, token2 in zip(tokens1, tokens2)]
+    calls = bench.compile_calls(name, [
+        (bench.proposer, swap, "propose_trades",
+         "sp.list([{}])".format(", ".join(proposals)), trades * MUTEZ_AMOUNT),
+        (bench.acceptor, swap, "accept_trades",
+         "sp.list([{}], t=sp.TNat)".format(", ".join("sp.nat({})".format(i) for i in range(trades))),
+         trades * MUTEZ_AMOUNT),
+    ])
+    return [
+        row(variant, mock, trades, 1, BASE["royalties"], BASE["fa2_contracts"], entrypoint, cost)
+        for (_, _, entrypoint, _, _), cost in zip(calls, bench.run_calls(calls))]
+
+
+def swap_call(value, parameter_type):
+    """Returns the SmartPy source of a parameter of a swap entry point."""
+    return "sp.set_type_expr({}, swap.XTZFA2Swap.{})".format(value, parameter_type)
+
+
+def commitment(trade_id, proposal):
+    """Returns the SmartPy source of a TRADE_COMMITMENT_PARAMETER_TYPE record."""
+    return swap_call("sp.record(trade_id=sp.nat({}), proposal={})".format(trade_id, proposal),
+                     "TRADE_COMMITMENT_PARAMETER_TYPE")
+
+
+def measure_entrypoints(bench, variant):
+    """Calls every entry point that doesn't need a signature, a Merkle proof,
+    time to pass or editions to split once, with the base configuration and
+    one royalty address per token. Returns the cost of the first call of
+    each entry point.
+    """
+    name = "{}_entrypoints".format(variant)
+    swap, tokens1, tokens2 = bench.setup_bundles(name, "fa2", 2, 1, 1, variant)
+    denied = bench.originate("fa2")
+    royalty_address = bench.royalty_accounts(1)[0]
+
+    # The first tokens are traded through a commitment, the second ones
+    # through a stored trade, then the proposer offers a token they received
+    proposal_a = trade_proposal(bench.proposer, swap, MUTEZ_AMOUNT, MUTEZ_AMOUNT, tokens1[:1], tokens2[:1])
+    proposal_b = trade_proposal(bench.proposer, swap, MUTEZ_AMOUNT, MUTEZ_AMOUNT, tokens1[1:], tokens2[1:])
+    proposal_c = trade_proposal(bench.proposer, swap, MUTEZ_AMOUNT, MUTEZ_AMOUNT, tokens2[:1], tokens1[:1])
+
+    calls = [
+        (bench.proposer, swap, "propose_trade", proposal_b, MUTEZ_AMOUNT),
+        (bench.proposer, swap, "amend_trade", swap_call(
+            "sp.record(trade_id=sp.nat(0), mutez_amount1=sp.mutez({}), mutez_amount2=sp.mutez({}), acceptor=sp.none)".format(
+                2 * MUTEZ_AMOUNT, MUTEZ_AMOUNT),
+            "AMEND_TRADE_ENTRYPOINT_PARAMETER_TYPES"), MUTEZ_AMOUNT),
+        (bench.proposer, swap, "cancel_trade_proposal", "sp.nat(0)", 0),
+        (bench.proposer, swap, "propose_trade_commitment", proposal_a, MUTEZ_AMOUNT),
+        (bench.proposer, swap, "cancel_trade_commitment", commitment(1, proposal_a), 0),
+        (bench.proposer, swap, "propose_trade_commitment", proposal_a, MUTEZ_AMOUNT),
+        (bench.acceptor, swap, "accept_trade_commitment", commitment(2, proposal_a), MUTEZ_AMOUNT),
+        (bench.proposer, swap, "propose_trade", proposal_b, MUTEZ_AMOUNT),
+        (bench.acceptor, swap, "accept_trade", "sp.nat(3)", MUTEZ_AMOUNT),
+        (bench.proposer, swap, "propose_trade", proposal_c, MUTEZ_AMOUNT),
+        (bench.proposer, swap, "invalidate_all_my_trades", "sp.unit", 0),
+        (bench.acceptor, swap, "refund_stale", "sp.list([sp.nat(4)])", 0),
+        (bench.proposer, swap, "cancel_signed_offers", "sp.list([sp.nat(0)])", 0),
+        (bench.proposer, swap, "commit_offer_root", swap_call(
+            'sp.record(root=sp.bytes("0x{}"), expiry=sp.timestamp(4102444800))'.format("00" * 32),
+            "COMMIT_OFFER_ROOT_ENTRYPOINT_PARAMETER_TYPES"), 0),
+        (bench.proposer, swap, "modify_denylist", swap_call(
+            'sp.record(contract=sp.address("{}"), deny=True)'.format(denied),
+            "DENY_ENTRYPOINT_PARAMETER_TYPES"), 0),
+        (bench.proposer, swap, "modify_admins", swap_call(
+            'sp.record(admin=sp.address("{}"), isAdmin=True)'.format(bench.acceptor),
+            "MODIFY_ADMINS_ENTRYPOINT_PARAMETER_TYPES"), 0),
+        (bench.proposer, swap, "modify_administrator", 'sp.address("{}")'.format(bench.proposer), 0),
+    ]
+    if variant == "swap_pull":
+        # Only the pulled royalties are credited, by the two accepts above
+        calls.append((bench.proposer, swap, "distribute_royalties",
+                      'sp.list([sp.address("{}")])'.format(royalty_address), 0))
+
+    rows = []
+    for (_, _, entrypoint, _, _), cost in zip(calls, bench.run_calls(bench.compile_calls(name, calls))):
+        if not any(r["entrypoint"] == entrypoint for r in rows):
+            rows.append(row(variant, "fa2", 1, 1, 1, BASE["fa2_contracts"], entrypoint, cost))
+    return rows
+
+
+def write_results(rows, output_dir):
+    """Writes the results as benchmark.csv and benchmark.json."""
+    with open(os.path.join(output_dir, "benchmark.csv"), "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(output_dir, "benchmark.json"), "w") as json_file:
+        json.dump(rows, json_file, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--smartpy", default="~/smartpy-cli/SmartPy.sh",
+                        help="path of the SmartPy CLI script")
+    parser.add_argument("--octez-client", default="octez-client",
+                        help="path of the octez-client binary")
+    parser.add_argument("--output", default=os.path.join(ROOT, "compilation", "benchmark"),
+                        help="directory of the compiled scripts and the results")
+    parser.add_argument("--full", action="store_true",
+                        help="measure every combination of the axes instead of one axis at a time")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    bench = Bench(SmartPy(args.smartpy, args.output), Mockup(args.octez_client))
+
+    rows = []
+    for config in configurations(args.full):
+        print("Measuring variant={} mock={} tokens={} royalties={} fa2_contracts={}".format(*config))
+        rows += measure(bench, *config)
+        write_results(rows, args.output)
+
+    for variant, mock, trades in itertools.product(VARIANTS, MOCKS, BATCHES):
+        print("Measuring variant={} mock={} batch={}".format(variant, mock, trades))
+        rows += measure_batch(bench, variant, mock, trades)
+        write_results(rows, args.output)
+
+    for variant in VARIANTS:
+        print("Measuring variant={} entry points".format(variant))
+        rows += measure_entrypoints(bench, variant)
+        write_results(rows, args.output)
+
+    print("Results written to {}".format(os.path.join(args.output, "benchmark.{csv,json}")))
+
+
+if __name__ == "__main__":
+    main()
@@ -36,27 +36,227 @@ class XTZFA2Swap(sp.Contract):
         # The first user's list of FA2 tokens to trade
         tokens1=sp.TList(TOKEN_TYPE),
         # The second user's list of FA2 tokens to trade
-        tokens2=sp.TList(TOKEN_TYPE)
+        tokens2=sp.TList(TOKEN_TYPE),
+        # When set, the trade can no longer be accepted from this time on
+        expires_at=sp.TOption(sp.TTimestamp),
+        # When set, the trade can be accepted a fraction at a time
+        divisible=sp.TBool
       ).layout(
           ("proposer",
               ("acceptor",
                   ("mutez_amount1",
                       ("mutez_amount2",
-                          ("tokens1", "tokens2")
+                          ("tokens1",
+                              ("tokens2",
+                                  ("expires_at", "divisible")
+                              )
+                          )
                       )
                   )
               )
           )
       )
 
+    ROYALTY_SPLIT_TYPE = sp.TRecord(
+        # How many shares of the 5% royalty each royalty address gets
+        shares=sp.TMap(sp.TAddress, sp.TNat),
+        # The total number of shares
+        denominator=sp.TNat
+    )
+
+    TRADE_STATUS_TYPE = sp.TVariant(
+        # The trade can be accepted
+        open=sp.TUnit,
+        # The proposer cancelled the trade
+        cancelled=sp.TUnit,
+        # The trade was accepted and executed by this address
+        executed=sp.TAddress
+    ).layout(
+        ("open",
+            ("cancelled", "executed")
+        )
+    )
+
     TRADE_TYPE = sp.TRecord(
-        proposer_accepted=sp.TBool,
-        acceptor_accepted=sp.TBool,
-        executed=sp.TBool,
-        executor=sp.TAddress,
+        # NOTE: Finished trades are removed, so a stored trade is always open
+        # and only events carry a status
+        # Royalty splits of each side, computed at proposal time
+        royalties1=ROYALTY_SPLIT_TYPE,
+        royalties2=ROYALTY_SPLIT_TYPE,
+        # The proposer epoch when the trade was proposed, the trade can't be
+        # accepted anymore once the proposer moves to a later epoch
+        epoch=sp.TNat,
+        proposal=TRADE_PROPOSAL_TYPE
+    )
+
+    TRANSFER_TX_TYPE = sp.TRecord(
+        # The receiver of the FA2 token editions
+        to_=sp.TAddress,
+        # The FA2 token's id
+        token_id=sp.TNat,
+        # The quantity of that token to transfer
+        amount=sp.TNat
+    ).layout(
+        ("to_",
+            ("token_id", "amount")
+        )
+    )
+
+    TRANSFER_TYPE = sp.TRecord(
+        # The current owner of the FA2 token editions
+        from_=sp.TAddress,
+        # Every edition to transfer away from that owner
+        txs=sp.TList(TRANSFER_TX_TYPE)
+    ).layout(
+        ("from_", "txs")
+    )
+
+    # Pending FA2 transfers grouped by FA2 contract, then by owner
+    FA2_TRANSFERS_TYPE = sp.TMap(
+        sp.TAddress,
+        sp.TMap(sp.TAddress, sp.TList(TRANSFER_TX_TYPE))
+    )
+
+    # Largest amount of each token id to prove ownership of, by FA2 contract
+    OWNERSHIP_CHECKS_TYPE = sp.TMap(
+        sp.TAddress,
+        sp.TMap(sp.TNat, sp.TNat)
+    )
+
+    TRADE_COMMITMENT_TYPE = sp.TRecord(
+        # The blake2b digest of the packed trade proposal
+        proposal_hash=sp.TBytes,
+        # The tez held in custody for the proposer
+        escrow=sp.TMutez,
+        # The proposer epoch when the commitment was proposed
+        epoch=sp.TNat
+    )
+
+    TRADE_COMMITMENT_PARAMETER_TYPE = sp.TRecord(
+        trade_id=sp.TNat,
+        # The full proposal, checked against the stored digest
         proposal=TRADE_PROPOSAL_TYPE
     )
 
+    SIGNED_OFFER_TYPE = sp.TRecord(
+        proposal=TRADE_PROPOSAL_TYPE,
+        # Makes every offer of a proposer unique, an offer can be used once
+        nonce=sp.TNat,
+        # The proposer epoch the offer was signed in
+        epoch=sp.TNat
+    )
+
+    SIGNED_OFFER_MESSAGE_TYPE = sp.TRecord(
+        # The chain and contract the offer is meant for, so the signature
+        # can't be replayed anywhere else
+        chain_id=sp.TChainId,
+        contract=sp.TAddress,
+        offer=SIGNED_OFFER_TYPE
+    )
+
+    ACCEPT_SIGNED_OFFER_ENTRYPOINT_PARAMETER_TYPES = sp.TRecord(
+        offer=SIGNED_OFFER_TYPE,
+        # The proposer's signature of the packed SIGNED_OFFER_MESSAGE_TYPE
+        signature=sp.TSignature,
+        public_key=sp.TKey
+    )
+
+    OFFER_ROOT_TYPE = sp.TRecord(
+        # The Merkle root of the packed ROOT_OFFER_TYPE leaves
+        root=sp.TBytes,
+        # The offers can no longer be accepted from this time on
+        expiry=sp.TTimestamp,
+        # The proposer epoch the root was committed in
+        epoch=sp.TNat
+    )
+
+    COMMIT_OFFER_ROOT_ENTRYPOINT_PARAMETER_TYPES = sp.TRecord(
+        root=sp.TBytes,
+        expiry=sp.TTimestamp
+    )
+
+    ROOT_OFFER_TYPE = sp.TRecord(
+        # The position of the leaf in the Merkle tree
+        index=sp.TNat,
+        proposal=TRADE_PROPOSAL_TYPE
+    )
+
+    ACCEPT_FROM_ROOT_ENTRYPOINT_PARAMETER_TYPES = sp.TRecord(
+        offer=ROOT_OFFER_TYPE,
+        # The sibling hashes from the leaf up to the root
+        proof=sp.TList(sp.TBytes)
+    )
+
+    TRADE_EVENT_TYPE = sp.TRecord(
+        trade_id=sp.TNat,
+        status=TRADE_STATUS_TYPE,
+        trade=TRADE_TYPE
+    )
+
+    TRADE_ACCEPTED_EVENT_TYPE = sp.TRecord(
+        trade_id=sp.TNat,
+        status=TRADE_STATUS_TYPE,
+        trade=TRADE_TYPE,
+        # The royalty paid or credited to every royalty address
+        royalties=sp.TMap(sp.TAddress, sp.TMutez)
+    )
+
+    ROOT_OFFER_ACCEPTED_EVENT_TYPE = sp.TRecord(
+        offer=ROOT_OFFER_TYPE,
+        acceptor=sp.TAddress,
+        # The royalty paid or credited to every royalty address
+        royalties=sp.TMap(sp.TAddress, sp.TMutez)
+    )
+
+    TRADE_COMMITMENT_ACCEPTED_EVENT_TYPE = sp.TRecord(
+        trade_id=sp.TNat,
+        proposal=TRADE_PROPOSAL_TYPE,
+        acceptor=sp.TAddress,
+        # The royalty paid or credited to every royalty address
+        royalties=sp.TMap(sp.TAddress, sp.TMutez)
+    )
+
+    SIGNED_OFFER_ACCEPTED_EVENT_TYPE = sp.TRecord(
+        offer=SIGNED_OFFER_TYPE,
+        acceptor=sp.TAddress,
+        # The royalty paid or credited to every royalty address
+        royalties=sp.TMap(sp.TAddress, sp.TMutez)
+    )
+
+    ACCEPT_TRADE_PARTIAL_ENTRYPOINT_PARAMETER_TYPES = sp.TRecord(
+        trade_id=sp.TNat,
+        # The fraction of the remaining trade to accept
+        numerator=sp.TNat,
+        denominator=sp.TNat
+    )
+
+    AMEND_TRADE_ENTRYPOINT_PARAMETER_TYPES = sp.TRecord(
+        trade_id=sp.TNat,
+        mutez_amount1=sp.TMutez,
+        mutez_amount2=sp.TMutez,
+        # The new acceptor, or none to keep the current one
+        acceptor=sp.TOption(sp.TAddress)
+    )
+
+    EPOCH_CHANGED_EVENT_TYPE = sp.TRecord(
+        proposer=sp.TAddress,
+        epoch=sp.TNat
+    )
+
+    SWEEP_EXPIRED_ENTRYPOINT_PARAMETER_TYPES = sp.TRecord(
+        # The trades to sweep, ids that are not expired are skipped
+        trade_ids=sp.TList(sp.TNat),
+        # The maximum number of trades to sweep, to keep gas bounded
+        limit=sp.TNat
+    )
+
+    GET_TRADES_VIEW_PARAMETER_TYPES = sp.TRecord(
+        # The first trade id of the page
+        from_=sp.TNat,
+        # The number of trade ids in the page
+        count=sp.TNat
+    )
+
     DENY_ENTRYPOINT_PARAMETER_TYPES = sp.TRecord(
         contract=sp.TAddress,
         deny=sp.TBool
@@ -67,7 +267,23 @@ class XTZFA2Swap(sp.Contract):
         isAdmin=sp.TBool
     )
 
-    def __init__(self, administrator):
+    ADMIN_CHANGED_EVENT_TYPE = sp.TVariant(
+        administrator=sp.TAddress,
+        admins=MODIFY_ADMINS_ENTRYPOINT_PARAMETER_TYPES
+    )
+
+    def __init__(self, administrator, pull_royalties=False, lazy_entry_points=False):
+        # When enabled, accepting a trade credits royalties to the
+        # royalty_balances ledger instead of sending them, and recipients
+        # collect them later with withdraw_royalties
+        self.pull_royalties = pull_royalties
+
+        # When enabled, every entry point body is stored as a lambda in a
+        # big map and only the called one is loaded, instead of the whole
+        # contract code being loaded for every call
+        if lazy_entry_points:
+            self.add_flag("lazy-entry-points")
+
         # Define the contract storage data types for clarity
         self.init_type(sp.TRecord(
             administrator=sp.TAddress,
@@ -75,6 +291,16 @@ class XTZFA2Swap(sp.Contract):
             counter=sp.TNat,
             admins=sp.TMap(sp.TAddress, sp.TBool),
             denylist=sp.TBigMap(sp.TAddress, sp.TBool),
+            royalty_balances=sp.TBigMap(sp.TAddress, sp.TMutez),
+            trade_commitments=sp.TBigMap(sp.TNat, XTZFA2Swap.TRADE_COMMITMENT_TYPE),
+            trades_by_user=sp.TBigMap(sp.TAddress, sp.TSet(sp.TNat)),
+            trades_by_token=sp.TBigMap(sp.TPair(sp.TAddress, sp.TNat), sp.TSet(sp.TNat)),
+            token_requests=sp.TBigMap(sp.TPair(sp.TPair(sp.TAddress, sp.TNat), sp.TNat), sp.TUnit),
+            offers_by_owner=sp.TBigMap(sp.TPair(sp.TAddress, sp.TPair(sp.TAddress, sp.TNat)), sp.TSet(sp.TNat)),
+            proposer_epoch=sp.TBigMap(sp.TAddress, sp.TNat),
+            used_nonces=sp.TBigMap(sp.TPair(sp.TAddress, sp.TNat), sp.TUnit),
+            offer_roots=sp.TBigMap(sp.TAddress, XTZFA2Swap.OFFER_ROOT_TYPE),
+            spent_offers=sp.TBigMap(sp.TPair(sp.TBytes, sp.TNat), sp.TNat),
             metadata=sp.TBigMap(sp.TString, sp.TBytes)))
 
         # Initialize the contract storage
@@ -86,6 +312,16 @@ class XTZFA2Swap(sp.Contract):
             counter=0,
             admins=sp.map(l = {administrator: True}, tkey = sp.TAddress, tvalue = sp.TBool),
             denylist=sp.big_map(),
+            royalty_balances=sp.big_map(),
+            trade_commitments=sp.big_map(),
+            trades_by_user=sp.big_map(),
+            trades_by_token=sp.big_map(),
+            token_requests=sp.big_map(),
+            offers_by_owner=sp.big_map(),
+            proposer_epoch=sp.big_map(),
+            used_nonces=sp.big_map(),
+            offer_roots=sp.big_map(),
+            spent_offers=sp.big_map(),
             metadata=sp.utils.metadata_of_url(
                 "https://arweave.net/7mcNzc3qe3D7M7SeebIpL_BtX1gbVcP0RRtK9pzBKX4"
             )
@@ -144,46 +380,140 @@ class XTZFA2Swap(sp.Contract):
         sp.verify(sp.amount == sp.tez(0),
                   message="The operation does not need tez")
 
-    def check_is_not_acceptor_accepted(self, trade_proposal):
-        """Checks that the acceptor has not already accepted the trade
+    def is_expired(self, trade_proposal):
+        """Returns whether the trade proposal has an expiry that has passed.
         """
-        sp.verify(~trade.acceptor_accepted,
-                    message="The trade is already accepted")
+        return trade_proposal.expires_at.is_some() & (sp.now >= trade_proposal.expires_at.open_some())
 
-    def check_trade_completely_accepted(self, trade):
-        """Checks the trade is accepted by both parties
+    def is_stale(self, trade):
+        """Returns whether the trade was proposed before its proposer's
+        current epoch.
         """
-        sp.verify((trade.proposer_accepted == True) & (trade.acceptor_accepted == True),
-                  message="Trade is not completely accepted")
+        return trade.epoch < self.data.proposer_epoch.get(trade.proposal.proposer, 0)
 
-    def check_trade_not_executed(self, trade_id):
-        """Checks that the trade id corresponds to an existing trade that has
-        not been executed.
+    def check_trade_is_current(self, trade):
+        """Checks that the proposer didn't invalidate the trade by moving to
+        a later epoch.
         """
-        # Check that the trade id is present in the trades big map
-        sp.verify(self.data.trades.contains(trade_id),
-                  message="The provided trade id doesn't exist")
+        sp.verify(~self.is_stale(trade),
+                  message="The trade was invalidated by its proposer")
+
+    def load_trade(self, trade_id):
+        """Reads a trade from the trades big map into a local with a single
+        big map access. Fails if the trade id doesn't exist.
+        """
+        return sp.local('trade', self.data.trades.get_opt(trade_id).open_some(
+            message="The provided trade id doesn't exist")).value
+
+    def hash_trade_proposal(self, trade_proposal):
+        """Returns the digest that identifies a trade proposal.
+        """
+        return sp.blake2b(sp.pack(sp.set_type_expr(trade_proposal, XTZFA2Swap.TRADE_PROPOSAL_TYPE)))
+
+    def get_trade_commitment(self, params):
+        """Reads a trade commitment and checks that the provided proposal is
+        the one that was committed. Fails if the trade id doesn't exist.
+        """
+        trade_commitment = sp.compute(self.data.trade_commitments.get_opt(params.trade_id).open_some(
+            message="The provided trade id doesn't exist"))
+        sp.verify(trade_commitment.proposal_hash == self.hash_trade_proposal(params.proposal),
+                  message="The trade proposal does not match the commitment")
+        return trade_commitment
 
-        # Check that the trade was not executed before
-        sp.verify(~self.data.trades[trade_id].executed,
-                  message="Trade already executed")
+    def is_stale_commitment(self, trade_commitment, trade_proposal):
+        """Returns whether the commitment was proposed before its proposer's
+        current epoch.
+        """
+        return trade_commitment.epoch < self.data.proposer_epoch.get(trade_proposal.proposer, 0)
+
+    def settle_offer(self, trade_proposal, payouts, transfers):
+        """Checks an offer that was never proposed on-chain, then queues its
+        tez payouts, royalties and FA2 transfers. Returns the royalty of every
+        royalty address.
+        """
+        # There is no tez in custody for an offer
+        sp.verify(trade_proposal.mutez_amount1 == sp.mutez(0),
+                  message="Offers can not include tez from the proposer")
+
+        # Check that the two involved users are not the same wallet
+        sp.verify(trade_proposal.proposer != trade_proposal.acceptor,
+                  message="The users involved in the trade need to be different")
+
+        # Check there is an FA2 token on each side of the trade
+        sp.verify(sp.len(trade_proposal.tokens1) > 0, message="At least one FA2 token needs to be traded by proposer")
+        sp.verify(sp.len(trade_proposal.tokens2) > 0, message="At least one FA2 token needs to be traded by acceptor")
+
+        sp.if trade_proposal.mutez_amount2 != sp.mutez(0):
+            # Check that the sent tez coincides with what was specified in the trade proposal
+            sp.verify(sp.amount == trade_proposal.mutez_amount2,
+                        message="The sent tez amount does not coincide trade proposal amount with 5% royalties")
+
+        # Royalty splits are not stored for offers, compute them now
+        return self.settle_trade(
+            trade_proposal=trade_proposal,
+            royalties1=self.compute_royalty_split(trade_proposal.tokens1, 'royalty_split1'),
+            royalties2=self.compute_royalty_split(trade_proposal.tokens2, 'royalty_split2'),
+            payouts=payouts,
+            transfers=transfers)
+
+    def hash_root_offer(self, offer):
+        """Returns the Merkle leaf of an offer committed in an offer root.
+        """
+        return sp.blake2b(sp.pack(sp.set_type_expr(offer, XTZFA2Swap.ROOT_OFFER_TYPE)))
+
+    def check_merkle_proof(self, leaf, index, proof, root):
+        """Checks that a leaf is at the given index of the Merkle tree with
+        the given root. The bits of the index tell on which side every sibling
+        of the proof is.
+        """
+        node = sp.local('node', leaf)
+        position = sp.local('position', index)
+        sp.for sibling in proof:
+            sp.if position.value % 2 == 0:
+                node.value = sp.blake2b(sp.concat([node.value, sibling]))
+            sp.else:
+                node.value = sp.blake2b(sp.concat([sibling, node.value]))
+            position.value = position.value // 2
+
+        sp.verify(node.value == root, message="The offer is not in the offer root")
+
+    def check_offer_is_unspent(self, root, index):
+        """Checks that the offer at an index of an offer root was not
+        accepted yet, then marks it as spent. Every big map entry is a bitmap
+        of 256 offers.
+        """
+        word = sp.pair(root, index // 256)
+        mask = sp.compute(sp.nat(1) << (index % 256))
+        bitmap = sp.compute(self.data.spent_offers.get(word, 0))
+        sp.verify((bitmap & mask) == 0, message="The offer was already accepted")
+        self.data.spent_offers[word] = bitmap | mask
+
+    def check_nonce_is_unused(self, proposer, nonce):
+        """Checks that a signed offer nonce of a proposer was neither used
+        nor cancelled, then marks it as used.
+        """
+        sp.verify(~self.data.used_nonces.contains(sp.pair(proposer, nonce)),
+                  message="The signed offer was already used or cancelled")
+        self.data.used_nonces[sp.pair(proposer, nonce)] = sp.unit
 
     def check_contract_is_allowed(self, contract):
-        """Checks that the trade id corresponds to an existing trade that has
-        not been executed.
+        """Checks that the FA2 contract is not on the denylist.
         """
-        # Check that the trade was not executed before
-        sp.verify(((~self.data.denylist.contains(contract)) | (self.data.denylist[contract] == False)),
+        # A single big map read, contracts missing from the denylist are allowed
+        sp.verify(~self.data.denylist.get(contract, False),
                   message="The contract is on the denylist")
 
-
-    @sp.entry_point
-    def propose_trade(self, trade_proposal):
-        """Proposes a trade between two users.
+    def check_contracts_are_allowed(self, transfers):
+        """Checks every FA2 contract of a batch of queued transfers or
+        ownership checks against the denylist, once per distinct contract.
         """
-        # Define the input parameter data type
-        sp.set_type(trade_proposal, XTZFA2Swap.TRADE_PROPOSAL_TYPE)
+        sp.for contract in transfers.value.keys():
+            self.check_contract_is_allowed(contract)
 
+    def check_trade_proposal(self, trade_proposal):
+        """Checks that a trade proposal is well formed and comes from the
+        proposer.
+        """
         # Check that the trade proposal comes from proposer
         self.check_is_proposer(trade_proposal)
 
@@ -195,6 +525,233 @@ class XTZFA2Swap(sp.Contract):
         sp.verify(sp.len(trade_proposal.tokens1) > 0, message="At least one FA2 token needs to be traded by proposer")
         sp.verify(sp.len(trade_proposal.tokens2) > 0, message="At least one FA2 token needs to be traded by acceptor")
 
+    def add_trade(self, trade_proposal):
+        """Stores a new trade under the next trade id.
+        """
+        # NOTE: By default, you're considered to have accepted your own trade
+        # NOTE: Royalty splits are computed once here so accepting is cheaper
+        trade = sp.compute(sp.record(
+            royalties1=self.compute_royalty_split(trade_proposal.tokens1, 'royalty_split1'),
+            royalties2=self.compute_royalty_split(trade_proposal.tokens2, 'royalty_split2'),
+            epoch=self.data.proposer_epoch.get(trade_proposal.proposer, 0),
+            proposal=trade_proposal))
+        self.data.trades[self.data.counter] = trade
+        self.emit_trade_event(
+            trade_id=self.data.counter,
+            status=sp.variant("open", sp.unit),
+            trade=trade,
+            tag="TradeProposed")
+
+        # Index the trade under both users involved
+        self.add_to_index(self.data.trades_by_user, trade_proposal.proposer, self.data.counter)
+        sp.if trade_proposal.acceptor != sp.self_address:
+            self.add_to_index(self.data.trades_by_user, trade_proposal.acceptor, self.data.counter)
+
+        # Index the trade under every token it offers
+        sp.for token in trade_proposal.tokens1:
+            self.add_to_index(self.data.trades_by_token, sp.pair(token.fa2, token.id), self.data.counter)
+
+        # Anyone can request any token, so requests are stored one key per
+        # token and trade instead of in a set that would grow without bounds
+        sp.for token in trade_proposal.tokens2:
+            self.data.token_requests[sp.pair(sp.pair(token.fa2, token.id), self.data.counter)] = sp.unit
+
+        # Index the tokens the proposer offers, which were checked to be
+        # theirs, so accepting a trade only visits the trades of its owners
+        sp.for token in trade_proposal.tokens1:
+            self.add_to_index(
+                self.data.offers_by_owner,
+                sp.pair(trade_proposal.proposer, sp.pair(token.fa2, token.id)),
+                self.data.counter)
+
+        # Increase the trade id counter for next proposal
+        self.data.counter += 1
+
+    def remove_trade(self, trade_id, trade_proposal):
+        """Removes a finished trade from the trades big map and its indexes.
+        """
+        del self.data.trades[trade_id]
+
+        self.remove_from_index(self.data.trades_by_user, trade_proposal.proposer, trade_id)
+        sp.if trade_proposal.acceptor != sp.self_address:
+            self.remove_from_index(self.data.trades_by_user, trade_proposal.acceptor, trade_id)
+
+        sp.for token in trade_proposal.tokens1:
+            self.remove_from_index(self.data.trades_by_token, sp.pair(token.fa2, token.id), trade_id)
+        sp.for token in trade_proposal.tokens2:
+            del self.data.token_requests[sp.pair(sp.pair(token.fa2, token.id), trade_id)]
+
+        sp.for token in trade_proposal.tokens1:
+            self.remove_from_index(
+                self.data.offers_by_owner,
+                sp.pair(trade_proposal.proposer, sp.pair(token.fa2, token.id)),
+                trade_id)
+
+    def add_to_index(self, index, key, trade_id):
+        """Adds a trade id to the set of trade ids an index keeps for a key.
+        The set is read and written back once.
+        """
+        trade_ids = sp.compute(index.get(key, sp.set(t=sp.TNat)))
+        trade_ids.add(trade_id)
+        index[key] = trade_ids
+
+    def remove_from_index(self, index, key, trade_id):
+        """Removes a trade id from the set of trade ids an index keeps for a
+        key, dropping the key once its set is empty. The set is read and
+        written back or deleted once.
+        """
+        trade_ids = sp.compute(index.get(key, sp.set(t=sp.TNat)))
+        trade_ids.remove(trade_id)
+        sp.if sp.len(trade_ids) == 0:
+            del index[key]
+        sp.else:
+            index[key] = trade_ids
+
+    def execute_trade(self, trade_id, payouts, transfers):
+        """Accepts a trade on behalf of the sender and queues its tez payouts
+        and FA2 transfers. Returns the accepted trade proposal.
+        """
+        # Load the trade once, every check and update below uses the local copy
+        trade = self.load_trade(trade_id)
+
+        # Check that the trade can still be accepted
+        self.check_trade_is_current(trade)
+
+        # Queue the tez payouts and token transfers of the trade
+        royalties = self.settle_trade(
+            trade_proposal=trade.proposal,
+            royalties1=trade.royalties1,
+            royalties2=trade.royalties2,
+            payouts=payouts,
+            transfers=transfers)
+
+        # Emit the trade as executed by the acceptor with the royalties it
+        # paid so its history can be rebuilt off-chain, then free its storage
+        sp.emit(
+            sp.set_type_expr(
+                sp.record(
+                    trade_id=trade_id,
+                    status=sp.variant("executed", sp.sender),
+                    trade=trade,
+                    royalties=royalties),
+                XTZFA2Swap.TRADE_ACCEPTED_EVENT_TYPE),
+            tag="TradeAccepted",
+            with_type=True)
+        self.remove_trade(trade_id=trade_id, trade_proposal=trade.proposal)
+
+        # The traded tokens changed hands, so the other trades that offer
+        # them on behalf of their previous owners can't be honoured anymore
+        self.invalidate_trades(
+            tokens=trade.proposal.tokens1,
+            owner=trade.proposal.proposer,
+            payouts=payouts,
+            accepted_trade_id=trade_id)
+        self.invalidate_trades(
+            tokens=trade.proposal.tokens2,
+            owner=sp.sender,
+            payouts=payouts,
+            accepted_trade_id=trade_id)
+
+        return trade.proposal
+
+    def invalidate_trades(self, tokens, owner, payouts, accepted_trade_id):
+        """Cancels the other open trades in which an owner offers at most as
+        many editions of a token as the owner just gave away, queuing the
+        refund of the tez held in custody for them.
+        """
+        # NOTE: The contract can't read the owner's remaining balance, so a
+        # trade is invalidated when the editions that moved would have been
+        # enough to honour it. Selling a whole NFT invalidates every other
+        # listing of it, selling a few fungible editions only invalidates the
+        # listings of as many editions or less
+        sp.for token in tokens:
+            trade_ids = sp.compute(self.data.offers_by_owner.get(
+                sp.pair(owner, sp.pair(token.fa2, token.id)), sp.set(t=sp.TNat)))
+            sp.for trade_id in trade_ids.elements():
+                # A previous token of the loop may have invalidated it already
+                other_trade_opt = sp.compute(self.data.trades.get_opt(trade_id))
+                sp.if (trade_id != accepted_trade_id) & other_trade_opt.is_some():
+                    other_trade = sp.compute(other_trade_opt.open_some())
+                    invalidated = sp.local('invalidated', False)
+                    sp.for other_token in other_trade.proposal.tokens1:
+                        sp.if (other_token.fa2 == token.fa2) & (other_token.id == token.id) & (other_token.amount <= token.amount):
+                            invalidated.value = True
+                    sp.if invalidated.value:
+                        self.add_payout(
+                            payouts=payouts,
+                            recipient=owner,
+                            amount=other_trade.proposal.mutez_amount1)
+                        self.emit_trade_event(
+                            trade_id=trade_id,
+                            status=sp.variant("cancelled", sp.unit),
+                            trade=other_trade,
+                            tag="TradeInvalidated")
+                        self.remove_trade(trade_id=trade_id, trade_proposal=other_trade.proposal)
+
+    def settle_trade(self, trade_proposal, royalties1, royalties2, payouts, transfers):
+        """Checks the sender can accept a trade proposal, then queues its tez
+        payouts, royalties and FA2 transfers. Returns the royalty of every
+        royalty address.
+        """
+        # Check that the sender is the trade acceptor and not the proposer
+        self.check_is_acceptor(trade_proposal)
+        self.check_is_not_proposer(trade_proposal)
+
+        # Check that the trade has not expired
+        sp.verify(~self.is_expired(trade_proposal),
+                  message="The trade has expired")
+
+        # Give every royalty address its cut of each side's 5% royalty, using
+        # the shares computed when the trade was proposed
+        royalty_payouts = sp.local('royalty_payouts', {}, sp.TMap(sp.TAddress, sp.TMutez))
+        royalties1Total = self.add_royalties(
+            payouts=payouts,
+            royalty_payouts=royalty_payouts,
+            royalty_split=royalties1,
+            mutez_amount=trade_proposal.mutez_amount1)
+        royalties2Total = self.add_royalties(
+            payouts=payouts,
+            royalty_payouts=royalty_payouts,
+            royalty_split=royalties2,
+            mutez_amount=trade_proposal.mutez_amount2)
+
+        # Transfer the locked tez from ESCROW/proposer to acceptor minus the 5% royalty fee
+        self.add_payout(
+            payouts=payouts,
+            recipient=sp.sender,
+            amount=trade_proposal.mutez_amount1 - royalties1Total)
+        # Transfer this tx's tez from acceptor to proposer minus the 5% royalty fee
+        self.add_payout(
+            payouts=payouts,
+            recipient=trade_proposal.proposer,
+            amount=trade_proposal.mutez_amount2 - royalties2Total)
+
+        # Transfer proposer's tokens to acceptor
+        self.add_fa2_transfers(
+            transfers=transfers,
+            tokens=trade_proposal.tokens1,
+            from_=trade_proposal.proposer,
+            to_=sp.sender)
+
+        # Transfer acceptor's tokens to proposer
+        self.add_fa2_transfers(
+            transfers=transfers,
+            tokens=trade_proposal.tokens2,
+            from_=sp.sender,
+            to_=trade_proposal.proposer)
+
+        return royalty_payouts.value
+
+    @sp.entry_point
+    def propose_trade(self, trade_proposal):
+        """Proposes a trade between two users.
+        """
+        # Define the input parameter data type
+        sp.set_type(trade_proposal, XTZFA2Swap.TRADE_PROPOSAL_TYPE)
+
+        # Check that the trade proposal is valid and comes from proposer
+        self.check_trade_proposal(trade_proposal)
+
         # Check that the tezos passed in to tx is the same as in the proposal
         sp.if trade_proposal.mutez_amount1 != sp.mutez(0):
             # Check that the sent tez sent to the contract coincides with
@@ -202,40 +759,55 @@ class XTZFA2Swap(sp.Contract):
             sp.verify(sp.amount == trade_proposal.mutez_amount1,
                         message="The sent tez amount does not coincide trade proposal amount with 5% royalties")
 
-        # Non-custodially ensure they own every token in the proposal
-        sp.for token in trade_proposal.tokens1:
-            # Check that the token is allowed to be listed
-            self.check_contract_is_allowed(token.fa2)
-            # Checks they own all editions by sending them to the contract and back.
-            # This is intentionally a no-op and two separate txs. Why? Some FA2 contracts dont
-            # allow self sending, we cant use get_balance since it will not return the value
-            # in the same entrypoint call, and balance_of is not guaranteed to be implemented.
-            # This is our best option.
-            self.fa2_transfer(
-                fa2=token.fa2,
-                from_=sp.sender,
-                to_=sp.self_address,
-                token_id=token.id,
-                token_amount=token.amount)
-            self.fa2_transfer(
-                fa2=token.fa2,
-                from_=sp.self_address,
-                to_=sp.sender,
-                token_id=token.id,
-                token_amount=token.amount)
+        # Checks they own all editions by sending them to the contract and back.
+        # This is intentionally a no-op and two separate txs. Why? Some FA2 contracts dont
+        # allow self sending, we cant use get_balance since it will not return the value
+        # in the same entrypoint call, and balance_of is not guaranteed to be implemented.
+        # This is our best option. Both legs are batched per FA2 contract.
+        ownership_checks = sp.local('ownership_checks', {}, XTZFA2Swap.OWNERSHIP_CHECKS_TYPE)
+        self.add_ownership_checks(
+            ownership_checks=ownership_checks,
+            tokens=trade_proposal.tokens1)
+        self.execute_ownership_checks(ownership_checks)
 
         # Update the trades order book bigmap with the new trade information
-        # NOTE: By default, you're considered to have accepted your own trade
-        # NOTE: By default, the executor is this contract to signify no executor
-        self.data.trades[self.data.counter] = sp.record(
-            proposer_accepted=True,
-            acceptor_accepted=False,
-            executed=False,
-            executor=sp.self_address,
-            proposal=trade_proposal)
+        self.add_trade(trade_proposal)
 
-        # Increase the trade id counter for next proposal
-        self.data.counter += 1
+    @sp.entry_point
+    def propose_trades(self, trade_proposals):
+        """Proposes a batch of trades at once. Ids are allocated consecutively
+        and ownership is checked once per FA2 contract for the whole batch.
+        """
+        # Define the input parameter data type
+        sp.set_type(trade_proposals, sp.TList(XTZFA2Swap.TRADE_PROPOSAL_TYPE))
+
+        sp.verify(sp.len(trade_proposals) > 0, message="At least one trade needs to be proposed")
+
+        # Sum of all the tez that needs to be held in custody for the batch
+        total_mutez = sp.local('total_mutez', sp.mutez(0))
+
+        ownership_checks = sp.local('ownership_checks', {}, XTZFA2Swap.OWNERSHIP_CHECKS_TYPE)
+
+        sp.for trade_proposal in trade_proposals:
+            # Check that the trade proposal is valid and comes from proposer
+            self.check_trade_proposal(trade_proposal)
+
+            total_mutez.value += trade_proposal.mutez_amount1
+
+            # Queue the ownership checks, shared with the rest of the batch
+            self.add_ownership_checks(
+                ownership_checks=ownership_checks,
+                tokens=trade_proposal.tokens1)
+
+            # Update the trades order book bigmap with the new trade information
+            self.add_trade(trade_proposal)
+
+        # Check that the sent tez coincides with the whole batch
+        sp.verify(sp.amount == total_mutez.value,
+                    message="The sent tez amount does not coincide trade proposal amount with 5% royalties")
+
+        # Checks they own all editions of the batch, see propose_trade
+        self.execute_ownership_checks(ownership_checks)
 
     @sp.entry_point
     def accept_trade(self, trade_id):
@@ -244,102 +816,196 @@ class XTZFA2Swap(sp.Contract):
         # Define the input parameter data type
         sp.set_type(trade_id, sp.TNat)
 
-        # Check that the trade was not executed before
-        self.check_trade_not_executed(trade_id)
+        payouts = sp.local('payouts', {}, sp.TMap(sp.TAddress, sp.TMutez))
+        transfers = sp.local('transfers', {}, XTZFA2Swap.FA2_TRANSFERS_TYPE)
 
-        # Check that the sender is the trade acceptor and not the proposer
-        trade = self.data.trades[trade_id]
-        self.check_is_acceptor(trade.proposal)
-        self.check_is_not_proposer(trade.proposal)
+        # Accept the trade and queue everything it needs to pay and transfer
+        trade_proposal = self.execute_trade(
+            trade_id=trade_id,
+            payouts=payouts,
+            transfers=transfers)
 
-        # Check that the user didn't accept the trade before
-        sp.verify(~trade.acceptor_accepted,
-                    message="The trade is already accepted")
+        sp.if trade_proposal.mutez_amount2 != sp.mutez(0):
+            # Check that the sent tez coincides with what was specified in the trade proposal
+            sp.verify(sp.amount == trade_proposal.mutez_amount2,
+                        message="The sent tez amount does not coincide trade proposal amount with 5% royalties")
 
-        # Accept the trade as acceptor
-        trade.acceptor_accepted = True
+        # Check that every FA2 contract is allowed to be traded still
+        self.check_contracts_are_allowed(transfers)
 
-        sp.if trade.proposal.mutez_amount2 != sp.mutez(0):
-            # Check that the sent tez coincides with what was specified in the trade proposal
-            sp.verify(sp.amount == trade.proposal.mutez_amount2,
+        # Pay both parties and swap the tokens
+        self.execute_payouts(payouts)
+        self.execute_fa2_transfers(transfers)
+
+    @sp.entry_point
+    def accept_trade_partial(self, params):
+        """Accepts a fraction of a divisible trade. The token amounts and tez
+        of both sides are scaled by the fraction and the remainder stays open
+        under the same trade id.
+        """
+        # Define the input parameter data type
+        sp.set_type(params, XTZFA2Swap.ACCEPT_TRADE_PARTIAL_ENTRYPOINT_PARAMETER_TYPES)
+
+        # Load the trade once, every check and update below uses the local copy
+        trade = self.load_trade(params.trade_id)
+
+        # Check that the trade can still be accepted
+        self.check_trade_is_current(trade)
+
+        # Check that the trade can be accepted a fraction at a time
+        sp.verify(trade.proposal.divisible, message="The trade is not divisible")
+
+        # Accepting the whole remainder is done with accept_trade
+        sp.verify((params.numerator > 0) & (params.numerator < params.denominator),
+                  message="The fraction must be strictly between 0 and 1")
+
+        # Scale every token amount, only exact fractions are allowed
+        filled_tokens1 = sp.local('filled_tokens1', [], sp.TList(XTZFA2Swap.TOKEN_TYPE))
+        remaining_tokens1 = sp.local('remaining_tokens1', [], sp.TList(XTZFA2Swap.TOKEN_TYPE))
+        filled_tokens2 = sp.local('filled_tokens2', [], sp.TList(XTZFA2Swap.TOKEN_TYPE))
+        remaining_tokens2 = sp.local('remaining_tokens2', [], sp.TList(XTZFA2Swap.TOKEN_TYPE))
+        self.split_trade_tokens(
+            tokens=trade.proposal.tokens1,
+            numerator=params.numerator,
+            denominator=params.denominator,
+            filled=filled_tokens1,
+            remaining=remaining_tokens1)
+        self.split_trade_tokens(
+            tokens=trade.proposal.tokens2,
+            numerator=params.numerator,
+            denominator=params.denominator,
+            filled=filled_tokens2,
+            remaining=remaining_tokens2)
+
+        # Scale the tez of both sides, rounding leftovers stay in the remainder
+        filled_proposal = sp.compute(sp.record(
+            proposer=trade.proposal.proposer,
+            acceptor=trade.proposal.acceptor,
+            mutez_amount1=sp.split_tokens(trade.proposal.mutez_amount1, params.numerator, params.denominator),
+            mutez_amount2=sp.split_tokens(trade.proposal.mutez_amount2, params.numerator, params.denominator),
+            tokens1=filled_tokens1.value,
+            tokens2=filled_tokens2.value,
+            expires_at=trade.proposal.expires_at,
+            divisible=trade.proposal.divisible))
+
+        payouts = sp.local('payouts', {}, sp.TMap(sp.TAddress, sp.TMutez))
+        transfers = sp.local('transfers', {}, XTZFA2Swap.FA2_TRANSFERS_TYPE)
+
+        # Queue the tez payouts and token transfers of the filled fraction
+        royalties = self.settle_trade(
+            trade_proposal=filled_proposal,
+            royalties1=trade.royalties1,
+            royalties2=trade.royalties2,
+            payouts=payouts,
+            transfers=transfers)
+
+        sp.if filled_proposal.mutez_amount2 != sp.mutez(0):
+            # Check that the sent tez coincides with the filled fraction of the trade proposal
+            sp.verify(sp.amount == filled_proposal.mutez_amount2,
                         message="The sent tez amount does not coincide trade proposal amount with 5% royalties")
 
-        # Triple check the trade is accepted on both sides
-        self.check_trade_completely_accepted(trade)
-
-        # Set the trade as executed and begin executing trade behavior
-        trade.executed = True
-        trade.executor = sp.sender
-
-        # Help calculate royalty fee and how many accounts to split it between
-        royalties1 = sp.mutez(0)
-        royaltyDenom1 = 0
-        royaltyDenom1Local = sp.local('royaltyDenom1Local', royaltyDenom1)
-        royalties2 = sp.mutez(0)
-        royaltyDenom2 = 0
-        royaltyDenom2Local = sp.local('royaltyDenom2Local', royaltyDenom2)
-
-        # Find sum of all royalty addresses to use as denominator later for splits
-        sp.for token in trade.proposal.tokens1:
-            royaltyDenom1Local.value = royaltyDenom1Local.value + sp.len(token.royalty_addresses)
-        # Transfer the locked tez from ESCROW/proposer to acceptor if there is tez
-        sp.if (trade.proposal.mutez_amount1 != sp.mutez(0)):
-            sp.if (royaltyDenom1Local.value > 0):
-                # Calculate 5% royalties for acceptor side
-                royalties1 = sp.split_tokens(trade.proposal.mutez_amount1, 1, 20)
-                sp.if (trade.proposal.mutez_amount1 - royalties1 != sp.mutez(0)):
-                    # Send proposed trade amount to user minus the 5% royalty fee
-                    sp.send(sp.sender, (trade.proposal.mutez_amount1 - royalties1))
-            sp.else:
-                sp.send(sp.sender, trade.proposal.mutez_amount1)
-
-        # Find sum of all royalty addresses to use as denominator later for splits
-        sp.for token in trade.proposal.tokens2:
-            royaltyDenom2Local.value = royaltyDenom2Local.value + sp.len(token.royalty_addresses)
-        # Transfer this tx's tez from acceptor to proposer if there is tez
-        sp.if (trade.proposal.mutez_amount2 != sp.mutez(0)):
-            sp.if (royaltyDenom2Local.value > 0):
-                # Calculate 5% royalties for acceptor side
-                royalties2 = sp.split_tokens(trade.proposal.mutez_amount2, 1, 20)
-                sp.if (trade.proposal.mutez_amount2 - royalties2 != sp.mutez(0)):
-                    # Send proposed trade amount to user minus the 5% royalty fee
-                    sp.send(trade.proposal.proposer, (trade.proposal.mutez_amount2 - royalties2))
-            sp.else:
-                sp.send(trade.proposal.proposer, (trade.proposal.mutez_amount2))
+        # Emit the filled fraction as executed by the acceptor
+        sp.emit(
+            sp.set_type_expr(
+                sp.record(
+                    trade_id=params.trade_id,
+                    status=sp.variant("executed", sp.sender),
+                    trade=sp.record(
+                        royalties1=trade.royalties1,
+                        royalties2=trade.royalties2,
+                        epoch=trade.epoch,
+                        proposal=filled_proposal),
+                    royalties=royalties),
+                XTZFA2Swap.TRADE_ACCEPTED_EVENT_TYPE),
+            tag="TradePartiallyAccepted",
+            with_type=True)
 
-        # Transfer proposer's tokens to acceptor
-        sp.for token in trade.proposal.tokens1:
-            # Check that the token is allowed to be traded still
-            self.check_contract_is_allowed(token.fa2)
-            # transfer FA2
-            self.fa2_transfer(
-                fa2=token.fa2,
-                from_=trade.proposal.proposer,
-                to_=sp.sender,
-                token_id=token.id,
-                token_amount=token.amount)
-            # Give every royalty address its cut of the 5% royalty
-            sp.for royalty_address in token.royalty_addresses:
-                royaltyCut = sp.split_tokens(royalties1, 1, royaltyDenom1Local.value)
-                sp.if (royaltyCut != sp.mutez(0)):
-                    sp.send(royalty_address, royaltyCut)
+        # Keep the remainder open, the tokens involved and so the indexes
+        # don't change
+        trade.proposal.mutez_amount1 = trade.proposal.mutez_amount1 - filled_proposal.mutez_amount1
+        trade.proposal.mutez_amount2 = trade.proposal.mutez_amount2 - filled_proposal.mutez_amount2
+        trade.proposal.tokens1 = remaining_tokens1.value
+        trade.proposal.tokens2 = remaining_tokens2.value
+        self.data.trades[params.trade_id] = trade
 
-        # Transfer acceptor's tokens to proposer
-        sp.for token in trade.proposal.tokens2:
-            # Check that the token is allowed to be traded still
-            self.check_contract_is_allowed(token.fa2)
-            # transfer FA2
-            self.fa2_transfer(
+        # The filled editions changed hands, invalidate the other trades they
+        # would have honoured, the remainder of this one stays open
+        self.invalidate_trades(
+            tokens=filled_proposal.tokens1,
+            owner=trade.proposal.proposer,
+            payouts=payouts,
+            accepted_trade_id=params.trade_id)
+        self.invalidate_trades(
+            tokens=filled_proposal.tokens2,
+            owner=sp.sender,
+            payouts=payouts,
+            accepted_trade_id=params.trade_id)
+
+        # Check that every FA2 contract is allowed to be traded still
+        self.check_contracts_are_allowed(transfers)
+
+        # Pay both parties and swap the tokens
+        self.execute_payouts(payouts)
+        self.execute_fa2_transfers(transfers)
+
+    def split_trade_tokens(self, tokens, numerator, denominator, filled, remaining):
+        """Splits the amount of every token of one side of a trade into the
+        accepted fraction and the remainder, keeping the token order.
+        """
+        sp.for token in tokens:
+            filled_amount = sp.compute(token.amount * numerator // denominator)
+            sp.verify(filled_amount * denominator == token.amount * numerator,
+                      message="The fraction does not divide the token amounts")
+            filled.value.push(sp.record(
                 fa2=token.fa2,
-                from_=sp.sender,
-                to_=trade.proposal.proposer,
-                token_id=token.id,
-                token_amount=token.amount)
-            # Give every royalty address its cut of the 5% royalty
-            sp.for royalty_address in token.royalty_addresses:
-                royaltyCut = sp.split_tokens(royalties2, 1, royaltyDenom2Local.value)
-                sp.if (royaltyCut != sp.mutez(0)):
-                    sp.send(royalty_address, royaltyCut)
+                id=token.id,
+                amount=filled_amount,
+                royalty_addresses=token.royalty_addresses))
+            remaining.value.push(sp.record(
+                fa2=token.fa2,
+                id=token.id,
+                amount=sp.as_nat(token.amount - filled_amount),
+                royalty_addresses=token.royalty_addresses))
+
+        # Pushing reversed both lists
+        filled.value = filled.value.rev()
+        remaining.value = remaining.value.rev()
+
+    @sp.entry_point
+    def accept_trades(self, trade_ids):
+        """Accepts a batch of trades atomically. Payouts to the same address
+        and transfers of the same FA2 contract are merged across the batch.
+        """
+        # Define the input parameter data type
+        sp.set_type(trade_ids, sp.TList(sp.TNat))
+
+        sp.verify(sp.len(trade_ids) > 0, message="At least one trade needs to be accepted")
+
+        # Sum of all the tez the acceptor owes for the batch
+        total_mutez = sp.local('total_mutez', sp.mutez(0))
+
+        payouts = sp.local('payouts', {}, sp.TMap(sp.TAddress, sp.TMutez))
+        transfers = sp.local('transfers', {}, XTZFA2Swap.FA2_TRANSFERS_TYPE)
+
+        sp.for trade_id in trade_ids:
+            # Accept the trade and queue everything it needs to pay and transfer
+            trade_proposal = self.execute_trade(
+                trade_id=trade_id,
+                payouts=payouts,
+                transfers=transfers)
+
+            total_mutez.value += trade_proposal.mutez_amount2
+
+        # Check that the sent tez coincides with the whole batch
+        sp.verify(sp.amount == total_mutez.value,
+                    message="The sent tez amount does not coincide trade proposal amount with 5% royalties")
+
+        # Check that every FA2 contract is allowed to be traded still
+        self.check_contracts_are_allowed(transfers)
+
+        # Pay every party and swap all the tokens
+        self.execute_payouts(payouts)
+        self.execute_fa2_transfers(transfers)
 
     @sp.entry_point
     def cancel_trade_proposal(self, trade_id):
@@ -352,24 +1018,489 @@ class XTZFA2Swap(sp.Contract):
         # Check that no tez have been transferred
         self.check_no_tez_transfer()
 
-        # Check that the trade was not executed before
-        self.check_trade_not_executed(trade_id)
+        # Load the trade once, every check and update below uses the local copy
+        trade = self.load_trade(trade_id)
 
         # Check that the sender is the proposer
-        trade = self.data.trades[trade_id]
         self.check_is_proposer(trade.proposal)
 
-        # Check that the user accepted the trade before
-        sp.verify(trade.proposer_accepted,
-                    message="The trade was not accepted before")
-
-        # Change the status to not accepted
-        trade.proposer_accepted = False
-
         # Transfer the locked tez back to the proposer
         sp.if trade.proposal.mutez_amount1 != sp.mutez(0):
             sp.send(sp.sender, trade.proposal.mutez_amount1)
 
+        # Emit the final state of the trade so its history can be rebuilt
+        # off-chain, then free its storage
+        self.emit_trade_event(
+            trade_id=trade_id,
+            status=sp.variant("cancelled", sp.unit),
+            trade=trade,
+            tag="TradeCancelled")
+        self.remove_trade(trade_id=trade_id, trade_proposal=trade.proposal)
+
+    @sp.entry_point
+    def amend_trade(self, params):
+        """Changes the tez amounts and optionally the acceptor of an open
+        trade, keeping its id and tokens. Only the difference with the tez
+        held in custody is sent or given back.
+        """
+        # Define the input parameter data type
+        sp.set_type(params, XTZFA2Swap.AMEND_TRADE_ENTRYPOINT_PARAMETER_TYPES)
+
+        # Load the trade once, every check and update below uses the local copy
+        trade = self.load_trade(params.trade_id)
+
+        # Check that the trade can still be amended
+        self.check_trade_is_current(trade)
+
+        # Check that the sender is the proposer
+        self.check_is_proposer(trade.proposal)
+
+        # Settle the difference with the tez held in custody
+        sp.if params.mutez_amount1 > trade.proposal.mutez_amount1:
+            sp.verify(sp.amount == params.mutez_amount1 - trade.proposal.mutez_amount1,
+                        message="The sent tez amount does not coincide with the trade proposal amount increase")
+        sp.else:
+            self.check_no_tez_transfer()
+            sp.if params.mutez_amount1 < trade.proposal.mutez_amount1:
+                sp.send(sp.sender, trade.proposal.mutez_amount1 - params.mutez_amount1)
+
+        trade.proposal.mutez_amount1 = params.mutez_amount1
+        trade.proposal.mutez_amount2 = params.mutez_amount2
+
+        # Move the trade to the new acceptor's index
+        sp.if params.acceptor.is_some():
+            acceptor = sp.compute(params.acceptor.open_some())
+            sp.verify(acceptor != trade.proposal.proposer,
+                      message="The users involved in the trade need to be different")
+
+            sp.if trade.proposal.acceptor != sp.self_address:
+                self.remove_from_index(self.data.trades_by_user, trade.proposal.acceptor, params.trade_id)
+            sp.if acceptor != sp.self_address:
+                self.add_to_index(self.data.trades_by_user, acceptor, params.trade_id)
+
+            trade.proposal.acceptor = acceptor
+
+        self.data.trades[params.trade_id] = trade
+        self.emit_trade_event(
+            trade_id=params.trade_id,
+            status=sp.variant("open", sp.unit),
+            trade=trade,
+            tag="TradeAmended")
+
+    @sp.entry_point
+    def sweep_expired(self, params):
+        """Allows anyone to remove a batch of expired trades, giving back the
+        tez held in custody to their proposers.
+        """
+        # Define the input parameter data type
+        sp.set_type(params, XTZFA2Swap.SWEEP_EXPIRED_ENTRYPOINT_PARAMETER_TYPES)
+
+        # Check that no tez have been transferred
+        self.check_no_tez_transfer()
+
+        # Number of trades swept so far, never more than the limit
+        swept = sp.local('swept', 0)
+
+        payouts = sp.local('payouts', {}, sp.TMap(sp.TAddress, sp.TMutez))
+
+        sp.for trade_id in params.trade_ids:
+            sp.if swept.value < params.limit:
+                trade_opt = sp.compute(self.data.trades.get_opt(trade_id))
+                sp.if trade_opt.is_some():
+                    trade = sp.compute(trade_opt.open_some())
+                    sp.if self.is_expired(trade.proposal):
+                        # Give back the tez held in custody
+                        self.add_payout(
+                            payouts=payouts,
+                            recipient=trade.proposal.proposer,
+                            amount=trade.proposal.mutez_amount1)
+
+                        # Emit the final state of the trade, then free its storage
+                        self.emit_trade_event(
+                            trade_id=trade_id,
+                            status=sp.variant("cancelled", sp.unit),
+                            trade=trade,
+                            tag="TradeExpired")
+                        self.remove_trade(trade_id=trade_id, trade_proposal=trade.proposal)
+
+                        swept.value += 1
+
+        # Refund every proposer once
+        self.execute_payouts(payouts)
+
+    @sp.entry_point
+    def invalidate_all_my_trades(self):
+        """Moves the sender to a new proposer epoch, so none of the trades
+        they proposed so far can be accepted anymore. The tez held in custody
+        for them is given back with refund_stale.
+        """
+        # Check that no tez have been transferred
+        self.check_no_tez_transfer()
+
+        epoch = sp.compute(self.data.proposer_epoch.get(sp.sender, 0) + 1)
+        self.data.proposer_epoch[sp.sender] = epoch
+
+        sp.emit(
+            sp.set_type_expr(
+                sp.record(proposer=sp.sender, epoch=epoch),
+                XTZFA2Swap.EPOCH_CHANGED_EVENT_TYPE),
+            tag="EpochChanged",
+            with_type=True)
+
+    @sp.entry_point
+    def refund_stale(self, trade_ids):
+        """Allows anyone to remove a batch of trades invalidated by their
+        proposers, giving back the tez held in custody to them.
+        """
+        # Define the input parameter data type
+        sp.set_type(trade_ids, sp.TList(sp.TNat))
+
+        # Check that no tez have been transferred
+        self.check_no_tez_transfer()
+
+        payouts = sp.local('payouts', {}, sp.TMap(sp.TAddress, sp.TMutez))
+
+        sp.for trade_id in trade_ids:
+            trade_opt = sp.compute(self.data.trades.get_opt(trade_id))
+            sp.if trade_opt.is_some():
+                trade = sp.compute(trade_opt.open_some())
+                sp.if self.is_stale(trade):
+                    # Give back the tez held in custody
+                    self.add_payout(
+                        payouts=payouts,
+                        recipient=trade.proposal.proposer,
+                        amount=trade.proposal.mutez_amount1)
+
+                    # Emit the final state of the trade, then free its storage
+                    self.emit_trade_event(
+                        trade_id=trade_id,
+                        status=sp.variant("cancelled", sp.unit),
+                        trade=trade,
+                        tag="TradeInvalidated")
+                    self.remove_trade(trade_id=trade_id, trade_proposal=trade.proposal)
+
+        # Refund every proposer once
+        self.execute_payouts(payouts)
+
+    @sp.entry_point
+    def refund_stale_commitments(self, params):
+        """Allows anyone to remove a batch of trade commitments invalidated by
+        their proposers, giving back the tez held in custody to them. Every
+        commitment comes with the proposal it was committed for.
+        """
+        # Define the input parameter data type
+        sp.set_type(params, sp.TList(XTZFA2Swap.TRADE_COMMITMENT_PARAMETER_TYPE))
+
+        # Check that no tez have been transferred
+        self.check_no_tez_transfer()
+
+        payouts = sp.local('payouts', {}, sp.TMap(sp.TAddress, sp.TMutez))
+
+        sp.for commitment in params:
+            trade_commitment_opt = sp.compute(self.data.trade_commitments.get_opt(commitment.trade_id))
+            sp.if trade_commitment_opt.is_some():
+                trade_commitment = sp.compute(trade_commitment_opt.open_some())
+
+                # Skip the proposals that don't match, their proposer is unknown
+                sp.if trade_commitment.proposal_hash == self.hash_trade_proposal(commitment.proposal):
+                    sp.if self.is_stale_commitment(trade_commitment, commitment.proposal):
+                        # Give back the tez held in custody
+                        self.add_payout(
+                            payouts=payouts,
+                            recipient=commitment.proposal.proposer,
+                            amount=trade_commitment.escrow)
+
+                        sp.emit(commitment, tag="TradeCommitmentInvalidated", with_type=True)
+                        del self.data.trade_commitments[commitment.trade_id]
+
+        # Refund every proposer once
+        self.execute_payouts(payouts)
+
+    @sp.entry_point
+    def propose_trade_commitment(self, trade_proposal):
+        """Proposes a trade but only stores a digest of the proposal, making
+        the storage cost of a listing constant. The full proposal is emitted
+        as an event and has to be provided again to accept or cancel it.
+        """
+        # Define the input parameter data type
+        sp.set_type(trade_proposal, XTZFA2Swap.TRADE_PROPOSAL_TYPE)
+
+        # Check that the trade proposal is valid and comes from proposer
+        self.check_trade_proposal(trade_proposal)
+
+        # Check that the sent tez coincides with what was specified in the trade proposal
+        sp.verify(sp.amount == trade_proposal.mutez_amount1,
+                    message="The sent tez amount does not coincide trade proposal amount with 5% royalties")
+
+        # Checks they own all editions, see propose_trade
+        ownership_checks = sp.local('ownership_checks', {}, XTZFA2Swap.OWNERSHIP_CHECKS_TYPE)
+        self.add_ownership_checks(
+            ownership_checks=ownership_checks,
+            tokens=trade_proposal.tokens1)
+        self.execute_ownership_checks(ownership_checks)
+
+        # Only store the digest of the proposal and the tez in custody
+        self.data.trade_commitments[self.data.counter] = sp.record(
+            proposal_hash=self.hash_trade_proposal(trade_proposal),
+            escrow=sp.amount,
+            epoch=self.data.proposer_epoch.get(trade_proposal.proposer, 0))
+
+        # Publish the full proposal so it can be found and accepted later
+        sp.emit(
+            sp.set_type_expr(
+                sp.record(trade_id=self.data.counter, proposal=trade_proposal),
+                XTZFA2Swap.TRADE_COMMITMENT_PARAMETER_TYPE),
+            tag="TradeCommitted",
+            with_type=True)
+
+        # Commitments share trade ids with regular trades
+        self.data.counter += 1
+
+    @sp.entry_point
+    def accept_trade_commitment(self, params):
+        """Accepts a trade that was proposed as a commitment.
+        """
+        # Define the input parameter data type
+        sp.set_type(params, XTZFA2Swap.TRADE_COMMITMENT_PARAMETER_TYPE)
+
+        # Check the provided proposal is the one that was committed
+        trade_commitment = self.get_trade_commitment(params)
+
+        # Check that the proposer didn't invalidate it since
+        sp.verify(~self.is_stale_commitment(trade_commitment, params.proposal),
+                  message="The trade was invalidated by its proposer")
+
+        sp.if params.proposal.mutez_amount2 != sp.mutez(0):
+            # Check that the sent tez coincides with what was specified in the trade proposal
+            sp.verify(sp.amount == params.proposal.mutez_amount2,
+                        message="The sent tez amount does not coincide trade proposal amount with 5% royalties")
+
+        payouts = sp.local('payouts', {}, sp.TMap(sp.TAddress, sp.TMutez))
+        transfers = sp.local('transfers', {}, XTZFA2Swap.FA2_TRANSFERS_TYPE)
+
+        # Royalty splits are not stored for commitments, compute them now
+        royalties = self.settle_trade(
+            trade_proposal=params.proposal,
+            royalties1=self.compute_royalty_split(params.proposal.tokens1, 'royalty_split1'),
+            royalties2=self.compute_royalty_split(params.proposal.tokens2, 'royalty_split2'),
+            payouts=payouts,
+            transfers=transfers)
+
+        sp.emit(
+            sp.set_type_expr(
+                sp.record(
+                    trade_id=params.trade_id,
+                    proposal=params.proposal,
+                    acceptor=sp.sender,
+                    royalties=royalties),
+                XTZFA2Swap.TRADE_COMMITMENT_ACCEPTED_EVENT_TYPE),
+            tag="TradeCommitmentAccepted",
+            with_type=True)
+        del self.data.trade_commitments[params.trade_id]
+
+        # Check that every FA2 contract is allowed to be traded still
+        self.check_contracts_are_allowed(transfers)
+
+        # Pay both parties and swap the tokens
+        self.execute_payouts(payouts)
+        self.execute_fa2_transfers(transfers)
+
+    @sp.entry_point
+    def cancel_trade_commitment(self, params):
+        """Cancels a trade that was proposed as a commitment, giving back the
+        tez held in custody.
+        """
+        # Define the input parameter data type
+        sp.set_type(params, XTZFA2Swap.TRADE_COMMITMENT_PARAMETER_TYPE)
+
+        # Check that no tez have been transferred
+        self.check_no_tez_transfer()
+
+        # Check the provided proposal is the one that was committed
+        trade_commitment = self.get_trade_commitment(params)
+
+        # Check that the sender is the proposer
+        self.check_is_proposer(params.proposal)
+
+        # Transfer the locked tez back to the proposer
+        sp.if trade_commitment.escrow != sp.mutez(0):
+            sp.send(sp.sender, trade_commitment.escrow)
+
+        sp.emit(params, tag="TradeCommitmentCancelled", with_type=True)
+        del self.data.trade_commitments[params.trade_id]
+
+    @sp.entry_point
+    def accept_signed_offer(self, params):
+        """Accepts a trade that the proposer signed off-chain instead of
+        proposing it. Nothing is stored for the offer, the proposer's tokens
+        and tez are moved when it is accepted, so it can't hold any tez in
+        custody.
+        """
+        # Define the input parameter data type
+        sp.set_type(params, XTZFA2Swap.ACCEPT_SIGNED_OFFER_ENTRYPOINT_PARAMETER_TYPES)
+
+        proposal = params.offer.proposal
+
+        # Check that the offer was signed by the proposer for this contract
+        sp.verify(sp.to_address(sp.implicit_account(sp.hash_key(params.public_key))) == proposal.proposer,
+                  message="The public key does not match the proposer")
+        sp.verify(sp.check_signature(
+            params.public_key,
+            params.signature,
+            sp.pack(sp.set_type_expr(
+                sp.record(chain_id=sp.chain_id, contract=sp.self_address, offer=params.offer),
+                XTZFA2Swap.SIGNED_OFFER_MESSAGE_TYPE))),
+            message="The signature does not match the signed offer")
+
+        # Check the offer can be used, once and in the proposer's current epoch
+        self.check_nonce_is_unused(proposal.proposer, params.offer.nonce)
+        sp.verify(params.offer.epoch == self.data.proposer_epoch.get(proposal.proposer, 0),
+                  message="The trade was invalidated by its proposer")
+
+        # Signed offers must expire, the expiry itself is checked on settlement
+        sp.verify(proposal.expires_at.is_some(), message="Signed offers need an expiry")
+
+        payouts = sp.local('payouts', {}, sp.TMap(sp.TAddress, sp.TMutez))
+        transfers = sp.local('transfers', {}, XTZFA2Swap.FA2_TRANSFERS_TYPE)
+
+        # Queue the tez payouts and token transfers of the offer
+        royalties = self.settle_offer(
+            trade_proposal=proposal,
+            payouts=payouts,
+            transfers=transfers)
+
+        sp.emit(
+            sp.set_type_expr(
+                sp.record(offer=params.offer, acceptor=sp.sender, royalties=royalties),
+                XTZFA2Swap.SIGNED_OFFER_ACCEPTED_EVENT_TYPE),
+            tag="SignedOfferAccepted",
+            with_type=True)
+
+        # Check that every FA2 contract is allowed to be traded still
+        self.check_contracts_are_allowed(transfers)
+
+        # Pay both parties and swap the tokens
+        self.execute_payouts(payouts)
+        self.execute_fa2_transfers(transfers)
+
+    @sp.entry_point
+    def cancel_signed_offers(self, nonces):
+        """Marks nonces of the sender as used, so the offers they signed
+        with them can't be accepted.
+        """
+        # Define the input parameter data type
+        sp.set_type(nonces, sp.TList(sp.TNat))
+
+        # Check that no tez have been transferred
+        self.check_no_tez_transfer()
+
+        sp.for nonce in nonces:
+            self.check_nonce_is_unused(sp.sender, nonce)
+
+        sp.emit(sp.record(proposer=sp.sender, nonces=nonces), tag="SignedOffersCancelled", with_type=True)
+
+    @sp.entry_point
+    def commit_offer_root(self, params):
+        """Lists any number of offers at once by committing the Merkle root of
+        the packed offers, replacing the sender's previous root. The offers
+        are accepted with accept_from_root.
+        """
+        # Define the input parameter data type
+        sp.set_type(params, XTZFA2Swap.COMMIT_OFFER_ROOT_ENTRYPOINT_PARAMETER_TYPES)
+
+        # Check that no tez have been transferred
+        self.check_no_tez_transfer()
+
+        sp.verify(params.expiry > sp.now, message="The offer root expiry has to be in the future")
+
+        self.data.offer_roots[sp.sender] = sp.record(
+            root=params.root,
+            expiry=params.expiry,
+            epoch=self.data.proposer_epoch.get(sp.sender, 0))
+
+        sp.emit(sp.record(proposer=sp.sender, root=params.root, expiry=params.expiry),
+                tag="OfferRootCommitted", with_type=True)
+
+    @sp.entry_point
+    def accept_from_root(self, params):
+        """Accepts an offer from the proposer's committed offer root, proving
+        it is part of it with a Merkle proof.
+        """
+        # Define the input parameter data type
+        sp.set_type(params, XTZFA2Swap.ACCEPT_FROM_ROOT_ENTRYPOINT_PARAMETER_TYPES)
+
+        proposal = params.offer.proposal
+
+        offer_root = sp.compute(self.data.offer_roots.get_opt(proposal.proposer).open_some(
+            message="The proposer has no offer root"))
+
+        # Check the root is still valid
+        sp.verify(sp.now < offer_root.expiry, message="The offer root has expired")
+        sp.verify(offer_root.epoch == self.data.proposer_epoch.get(proposal.proposer, 0),
+                  message="The trade was invalidated by its proposer")
+
+        # Check the offer is part of the root and can be accepted only once
+        self.check_merkle_proof(
+            leaf=self.hash_root_offer(params.offer),
+            index=params.offer.index,
+            proof=params.proof,
+            root=offer_root.root)
+        self.check_offer_is_unspent(offer_root.root, params.offer.index)
+
+        payouts = sp.local('payouts', {}, sp.TMap(sp.TAddress, sp.TMutez))
+        transfers = sp.local('transfers', {}, XTZFA2Swap.FA2_TRANSFERS_TYPE)
+
+        # Queue the tez payouts and token transfers of the offer
+        royalties = self.settle_offer(
+            trade_proposal=proposal,
+            payouts=payouts,
+            transfers=transfers)
+
+        sp.emit(
+            sp.set_type_expr(
+                sp.record(offer=params.offer, acceptor=sp.sender, royalties=royalties),
+                XTZFA2Swap.ROOT_OFFER_ACCEPTED_EVENT_TYPE),
+            tag="RootOfferAccepted",
+            with_type=True)
+
+        # Check that every FA2 contract is allowed to be traded still
+        self.check_contracts_are_allowed(transfers)
+
+        # Pay both parties and swap the tokens
+        self.execute_payouts(payouts)
+        self.execute_fa2_transfers(transfers)
+
+    @sp.entry_point
+    def withdraw_royalties(self):
+        """Sends the sender every royalty credited to them so far.
+        """
+        # Check that no tez have been transferred
+        self.check_no_tez_transfer()
+
+        # Empty the sender's royalty balance and pay it out in one go
+        balance = sp.compute(self.data.royalty_balances.get_opt(sp.sender).open_some(
+            message="There are no royalties to withdraw"))
+        del self.data.royalty_balances[sp.sender]
+        sp.send(sp.sender, balance)
+
+    @sp.entry_point
+    def distribute_royalties(self, recipients):
+        """Allows an admin to push the credited royalties of a batch of
+        recipients.
+        """
+        # Define the input parameter data type
+        sp.set_type(recipients, sp.TList(sp.TAddress))
+
+        self.check_is_administrator()
+
+        # Check that no tez have been transferred
+        self.check_no_tez_transfer()
+
+        sp.for recipient in recipients:
+            sp.if self.data.royalty_balances.contains(recipient):
+                sp.send(recipient, self.data.royalty_balances[recipient])
+                del self.data.royalty_balances[recipient]
+
     @sp.entry_point
     def modify_denylist(self, denyRec):
         """Adds an FA2 contract address to the list of contracts that have
@@ -383,6 +1514,8 @@ class XTZFA2Swap(sp.Contract):
         # Throw the contract address on the list
         self.data.denylist[denyRec.contract] = denyRec.deny;
 
+        sp.emit(denyRec, tag="DenylistChanged", with_type=True)
+
     @sp.entry_point
     def modify_administrator(self, administrator):
         """Allows the administrator to assign a new administrator
@@ -395,6 +1528,11 @@ class XTZFA2Swap(sp.Contract):
         # Throw the contract address on the list
         self.data.administrator = administrator;
 
+        sp.emit(
+            sp.set_type_expr(sp.variant("administrator", administrator), XTZFA2Swap.ADMIN_CHANGED_EVENT_TYPE),
+            tag="AdminChanged",
+            with_type=True)
+
     @sp.entry_point
     def modify_admins(self, modifyAdmin):
         """Allows the administrator to assign a new administrator
@@ -407,42 +1545,226 @@ class XTZFA2Swap(sp.Contract):
         # Throw the contract address on the list
         self.data.admins[modifyAdmin.admin] = modifyAdmin.isAdmin;
 
+        sp.emit(
+            sp.set_type_expr(sp.variant("admins", modifyAdmin), XTZFA2Swap.ADMIN_CHANGED_EVENT_TYPE),
+            tag="AdminChanged",
+            with_type=True)
+
+    @sp.onchain_view()
+    def get_trade(self, trade_id):
+        """Returns an open trade. Fails if the trade id doesn't exist.
+        """
+        # Define the input parameter data type
+        sp.set_type(trade_id, sp.TNat)
+
+        sp.result(self.data.trades.get(trade_id, message="The provided trade id doesn't exist"))
+
+    @sp.onchain_view()
+    def get_trades(self, params):
+        """Returns the open trades of a page of trade ids, keyed by id. Ids
+        of finished trades and commitments are left out.
+        """
+        # Define the input parameter data type
+        sp.set_type(params, XTZFA2Swap.GET_TRADES_VIEW_PARAMETER_TYPES)
+
+        trades = sp.local('trades', {}, sp.TMap(sp.TNat, XTZFA2Swap.TRADE_TYPE))
+        sp.for trade_id in sp.range(params.from_, params.from_ + params.count):
+            trade = sp.compute(self.data.trades.get_opt(trade_id))
+            sp.if trade.is_some():
+                trades.value[trade_id] = trade.open_some()
+        sp.result(trades.value)
+
+    @sp.onchain_view()
+    def get_trades_by_user(self, user):
+        """Returns the ids of the open trades a user proposed or is the named
+        acceptor of.
+        """
+        # Define the input parameter data type
+        sp.set_type(user, sp.TAddress)
+
+        sp.result(self.data.trades_by_user.get(user, sp.set(t=sp.TNat)))
+
+    @sp.onchain_view()
+    def get_trades_by_token(self, token):
+        """Returns the ids of the open trades that offer a token.
+        """
+        # Define the input parameter data type
+        sp.set_type(token, sp.TPair(sp.TAddress, sp.TNat))
+
+        sp.result(self.data.trades_by_token.get(token, sp.set(t=sp.TNat)))
+
+    @sp.onchain_view()
+    def is_token_requested(self, params):
+        """Returns whether an open trade requests a token.
+        """
+        # Define the input parameter data type
+        sp.set_type(params, sp.TRecord(token=sp.TPair(sp.TAddress, sp.TNat), trade_id=sp.TNat))
+
+        sp.result(self.data.token_requests.contains(sp.pair(params.token, params.trade_id)))
+
+    @sp.onchain_view()
+    def get_proposer_epoch(self, proposer):
+        """Returns the epoch new trades of a proposer get, older trades of
+        theirs can't be accepted.
+        """
+        # Define the input parameter data type
+        sp.set_type(proposer, sp.TAddress)
+
+        sp.result(self.data.proposer_epoch.get(proposer, 0))
 
-    def fa2_transfer(self, fa2, from_, to_, token_id, token_amount):
-        """Transfers a number of editions of a FA2 token between two addresses.
+    @sp.onchain_view()
+    def get_counter(self):
+        """Returns the trade id the next proposal will get.
+        """
+        sp.result(self.data.counter)
+
+    def emit_trade_event(self, trade_id, status, trade, tag):
+        """Emits a contract event with the state and status of a trade.
+        """
+        sp.emit(
+            sp.set_type_expr(
+                sp.record(trade_id=trade_id, status=status, trade=trade),
+                XTZFA2Swap.TRADE_EVENT_TYPE),
+            tag=tag,
+            with_type=True)
+
+    def add_payout(self, payouts, recipient, amount):
+        """Queues a tez payout, merged with any other payout to the same
+        recipient.
+        """
+        sp.if amount != sp.mutez(0):
+            payouts.value[recipient] = payouts.value.get(recipient, sp.mutez(0)) + amount
+
+    def compute_royalty_split(self, tokens, name):
+        """Counts how many times each royalty address appears on a list of
+        tokens. Each appearance is one share of that side's 5% royalty.
+        """
+        royalty_split = sp.local(name, sp.record(shares={}, denominator=0), XTZFA2Swap.ROYALTY_SPLIT_TYPE)
+        sp.for token in tokens:
+            sp.for royalty_address in token.royalty_addresses:
+                royalty_split.value.shares[royalty_address] = royalty_split.value.shares.get(royalty_address, 0) + 1
+            royalty_split.value.denominator += sp.len(token.royalty_addresses)
+        return royalty_split.value
+
+    def add_royalties(self, payouts, royalty_payouts, royalty_split, mutez_amount):
+        """Queues the 5% royalty of one side of a trade, split between its
+        royalty addresses by share, and records it in royalty_payouts.
+        Returns the total royalty.
+        """
+        # There is only a royalty if someone can receive it
+        royalties = sp.compute(sp.eif(
+            royalty_split.denominator > 0,
+            sp.split_tokens(mutez_amount, 1, 20),
+            sp.mutez(0)))
+        sp.for share in royalty_split.shares.items():
+            royalty = sp.compute(sp.split_tokens(royalties, share.value, royalty_split.denominator))
+            self.add_royalty(
+                payouts=payouts,
+                recipient=share.key,
+                amount=royalty)
+            self.add_payout(
+                payouts=royalty_payouts,
+                recipient=share.key,
+                amount=royalty)
+        return royalties
+
+    def add_royalty(self, payouts, recipient, amount):
+        """Queues a royalty payout, or credits it to the recipient's royalty
+        balance when the contract pulls royalties.
+        """
+        if self.pull_royalties:
+            sp.if amount != sp.mutez(0):
+                self.data.royalty_balances[recipient] = self.data.royalty_balances.get(
+                    recipient, sp.mutez(0)) + amount
+        else:
+            self.add_payout(
+                payouts=payouts,
+                recipient=recipient,
+                amount=amount)
+
+    def execute_payouts(self, payouts):
+        """Sends every queued tez payout, one transaction per recipient.
+        """
+        sp.for payout in payouts.value.items():
+            sp.send(payout.key, payout.value)
+
+    def add_fa2_transfers(self, transfers, tokens, from_, to_):
+        """Queues the transfer of a list of tokens from one owner to another,
+        grouped by FA2 contract and owner so they can be sent in batches.
+        """
+        sp.for token in tokens:
+            sp.if ~transfers.value.contains(token.fa2):
+                transfers.value[token.fa2] = {}
+            sp.if ~transfers.value[token.fa2].contains(from_):
+                transfers.value[token.fa2][from_] = []
+            transfers.value[token.fa2][from_].push(sp.record(
+                to_=to_,
+                token_id=token.id,
+                amount=token.amount))
+
+    def execute_fa2_transfers(self, transfers):
+        """Sends every queued transfer with a single transfer call per FA2
+        contract, containing the txs of every owner for that contract.
+        """
+        sp.for batch in transfers.value.items():
+            self.fa2_batch_transfer(
+                fa2=batch.key,
+                transfers=batch.value.items().map(
+                    lambda owner: sp.record(from_=owner.key, txs=owner.value)))
+
+    def add_ownership_checks(self, ownership_checks, tokens):
+        """Queues the proof that the sender owns a list of tokens, grouped by
+        FA2 contract. A token listed several times only needs to be owned in
+        the largest of the listed amounts.
+        """
+        sp.for token in tokens:
+            sp.if ~ownership_checks.value.contains(token.fa2):
+                ownership_checks.value[token.fa2] = {}
+            ownership_checks.value[token.fa2][token.id] = sp.max(
+                ownership_checks.value[token.fa2].get(token.id, 0),
+                token.amount)
+
+    def execute_ownership_checks(self, ownership_checks):
+        """Proves ownership by sending the queued tokens from the sender to
+        this contract and back, with at most one outbound and one return
+        transfer call per FA2 contract.
+        """
+        # Check that every FA2 contract is allowed to be listed
+        self.check_contracts_are_allowed(ownership_checks)
+
+        sp.for batch in ownership_checks.value.items():
+            outbound_txs = sp.local('outbound_txs', [], sp.TList(XTZFA2Swap.TRANSFER_TX_TYPE))
+            inbound_txs = sp.local('inbound_txs', [], sp.TList(XTZFA2Swap.TRANSFER_TX_TYPE))
+            sp.for token in batch.value.items():
+                outbound_txs.value.push(sp.record(
+                    to_=sp.self_address,
+                    token_id=token.key,
+                    amount=token.value))
+                inbound_txs.value.push(sp.record(
+                    to_=sp.sender,
+                    token_id=token.key,
+                    amount=token.value))
+            self.fa2_batch_transfer(
+                fa2=batch.key,
+                transfers=sp.list([sp.record(from_=sp.sender, txs=outbound_txs.value)]))
+            self.fa2_batch_transfer(
+                fa2=batch.key,
+                transfers=sp.list([sp.record(from_=sp.self_address, txs=inbound_txs.value)]))
+
+    def fa2_batch_transfer(self, fa2, transfers):
+        """Calls the transfer entry point of a FA2 contract once with a whole
+        batch of transfers.
         """
         # Get a handle to the FA2 token transfer entry point
         c = sp.contract(
-            t=sp.TList(
-                sp.TRecord(
-                    from_=sp.TAddress,
-                    txs=sp.TList(
-                        sp.TRecord(
-                            to_=sp.TAddress,
-                            token_id=sp.TNat,
-                            amount=sp.TNat
-                        ).layout(
-                            ("to_",
-                                ("token_id", "amount")
-                            )
-                        )
-                    )
-                )
-            ),
+            t=sp.TList(XTZFA2Swap.TRANSFER_TYPE),
             address=fa2,
             entry_point="transfer"
         ).open_some()
 
-        # Transfer the FA2 token editions to the new address
+        # Transfer all the FA2 token editions in one go
         sp.transfer(
-            arg=sp.list([sp.record(
-                from_=from_,
-                txs=sp.list([sp.record(
-                    to_=to_,
-                    token_id=token_id,
-                    amount=token_amount
-                )])
-            )]),
+            arg=transfers,
             amount=sp.mutez(0),
             destination=c
         )
@@ -456,3 +1778,8 @@ sp.add_compilation_target("xtznftswap-ghostnet", XTZFA2Swap(
 sp.add_compilation_target("xtznftswap-mainnet", XTZFA2Swap(
   administrator=sp.address("tz1gp2XcTnpGxYcfYvyukB8c6B7iu3VRKp8B"),
 ))
+# Add the same compilation target with lazily loaded entry points
+sp.add_compilation_target("xtznftswap-mainnet-lazy", XTZFA2Swap(
+  administrator=sp.address("tz1gp2XcTnpGxYcfYvyukB8c6B7iu3VRKp8B"),
+  lazy_entry_points=True,
+))
@@ -86,6 +86,8 @@ def test_kyc_trade():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         sender = sp.test_account("Administrator").address,
         amount = sp.tez(1),
@@ -108,8 +110,9 @@ def test_kyc_trade():
     # set acceptor to an address, signifying a KYC trade.
     # set 2 royalty addresses for each token to test auto 5% royalty splits.
     # NOTE: you must check log.html to validate the royalty fees transferred.
-    #       in this test 0.025 to each royalty account in first trade
-    #       in this test 0.050 to each royalty account in second trade
+    #       in this test 0.025 to each royalty account of the first token
+    #       in this test 0.050 to each royalty account of the second token
+    #       Johnny is on both tokens and gets a single 0.075 transfer
     swapC.propose_trade(sp.record(
         mutez_amount1 = sp.tez(1),
         mutez_amount2 = sp.tez(2),
@@ -137,6 +140,8 @@ def test_kyc_trade():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         sender = sp.test_account("Administrator").address,
         amount = sp.tez(1),
@@ -178,6 +183,11 @@ def test_kyc_trade():
       amount=sp.tez(2),
     )
 
+    # verify the trade is indexed under the proposer and the named acceptor
+    scenario.verify(swapC.get_trades_by_user(sp.test_account("Administrator").address).contains(0))
+    scenario.verify(swapC.get_trades_by_user(sp.test_account("Alice").address).contains(0))
+    scenario.verify(sp.len(swapC.get_trades_by_user(sp.test_account("Robert").address)) == 0)
+
     # FAIL: you cant send wrong tez amount
     swapC.accept_trade(0).run(
       valid=False,
@@ -238,6 +248,10 @@ def test_kyc_trade():
     # verify the contract holds no balance of tez now
     scenario.verify(swapC.balance == sp.mutez(0))
 
+    # verify the accepted trade is no longer indexed for either user
+    scenario.verify(~swapC.data.trades_by_user.contains(sp.test_account("Administrator").address))
+    scenario.verify(~swapC.data.trades_by_user.contains(sp.test_account("Alice").address))
+
     # FAIL: can't accept the same trade twice
     swapC.accept_trade(0).run(
       valid=False,
@@ -267,6 +281,8 @@ def test_kyc_trade():
         ]),
         proposer = sp.test_account("Alice").address,
         acceptor = sp.test_account("Administrator").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         sender = sp.test_account("Alice").address,
         amount = sp.tez(0),
@@ -346,6 +362,8 @@ def test_anon_trade():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = swapC.address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         sender = sp.test_account("Administrator").address,
         amount = sp.tez(1),
@@ -389,6 +407,8 @@ def test_anon_trade():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = swapC.address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         sender = sp.test_account("Administrator").address,
         amount = sp.tez(1),
@@ -455,11 +475,13 @@ def test_anon_trade():
     scenario.verify(swapC.balance == sp.mutez(0))
 
     # check you can't accept the trade again even with correct tezos
+    # the executed trade has been removed from storage
+    scenario.verify(~swapC.data.trades.contains(0))
     swapC.accept_trade(0).run(
       valid=False,
       sender=sp.test_account("Alice").address,
       amount=sp.tez(2),
-      exception='Trade already executed'
+      exception="The provided trade id doesn't exist"
     )
 
 
@@ -541,6 +563,8 @@ def test_anon_weird_trade():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = swapC.address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         sender = sp.test_account("Administrator").address,
         amount = sp.tez(0),
@@ -640,6 +664,8 @@ def test_cancel():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         sender = sp.test_account("Administrator").address,
         amount = sp.tez(1),
@@ -668,10 +694,13 @@ def test_cancel():
     # verify the contract holds no balance of tez now
     scenario.verify(swapC.balance == sp.mutez(0))
 
+    # the cancelled trade has been removed from storage
+    scenario.verify(~swapC.data.trades.contains(0))
+
     # you cannot accept the trade bc proposer has cancelled/un-accepted
     swapC.accept_trade(0).run(
       valid=False,
-      exception='Trade is not completely accepted',
+      exception="The provided trade id doesn't exist",
       sender=sp.test_account("Alice").address,
       amount=sp.tez(2)
     )
@@ -698,6 +727,8 @@ def test_cancel():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         sender = sp.test_account("Administrator").address,
         amount = sp.tez(1)
@@ -798,6 +829,8 @@ def test_fail_propose():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         valid = False,
         exception = 'Missing item in map',
@@ -883,6 +916,8 @@ def test_fail_accept_lost_tokens():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         sender = sp.test_account("Administrator").address,
         amount = sp.tez(1),
@@ -993,6 +1028,8 @@ def test_fail_accept_not_acceptor():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         sender = sp.test_account("Administrator").address,
         amount = sp.tez(1),
@@ -1090,6 +1127,8 @@ def test_fail_propose_bad_proposals():
         tokens2 = sp.list(),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         valid = False,
         exception = "At least one FA2 token needs to be traded by proposer",
@@ -1113,6 +1152,8 @@ def test_fail_propose_bad_proposals():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         valid = False,
         exception = "At least one FA2 token needs to be traded by proposer",
@@ -1136,6 +1177,8 @@ def test_fail_propose_bad_proposals():
         tokens2 = sp.list(),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         valid = False,
         exception = "At least one FA2 token needs to be traded by acceptor",
@@ -1166,6 +1209,8 @@ def test_fail_propose_bad_proposals():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         valid = False,
         exception = "The sent tez amount does not coincide trade proposal amount with 5% royalties",
@@ -1196,6 +1241,8 @@ def test_fail_propose_bad_proposals():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Administrator").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         valid = False,
         exception = "The users involved in the trade need to be different",
@@ -1226,6 +1273,8 @@ def test_fail_propose_bad_proposals():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         valid = False,
         exception = "This can only be executed by the trade proposer",
@@ -1320,6 +1369,8 @@ def test_denylist_propose():
         ]),
         proposer = sp.test_account("Administrator").address,
         acceptor = swapC.address,
+        expires_at = sp.none,
+        divisible = False,
     )).run(
         sender = sp.test_account("Administrator").address,
         amount = sp.tez(1),
@@ -1359,3 +1410,1952 @@ def test_denylist_propose():
         valid = False,
         exception = 'NOT_ADMIN',
     )
+
+@sp.add_test(name = "Propose and accept a multi token bundle")
+def test_bundle_trade():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the two FA2 contracts
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    fa2_2 = fa2Contract.FA2(
+        config=fa2Contract.FA2_config(),
+        admin=fa2_admin.address,
+        metadata=sp.utils.metadata_of_url("ipfs://bbb"))
+
+    # Add the 2 fa2 contracts to the scenario
+    scenario += fa2_1
+    scenario += fa2_2
+
+    # Instantiate the swap contract
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+    )
+
+    # Add the swap contract to the scenario
+    scenario += swapC
+
+    # Mint tokens 0, 1 and 2 on the first contract, give token 2 to alice
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[sp.record(
+            to_=sp.test_account("Alice").address,
+            token_id=2,
+            amount=1
+          )]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # Mint 10 editions of token 0 on the second contract for alice
+    fa2_2.mint(
+        address=sp.test_account("Alice").address,
+        token_id=sp.nat(0),
+        amount=sp.nat(10),
+        metadata={"" : sp.utils.bytes_of_string("ipfs://ccc")}).run(sender=fa2_admin)
+
+    # allow the swap contract to operate on every token in the bundle
+    fa2_1.update_operators([
+        sp.variant("add_operator", fa2_2.operator_param.make(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=0)),
+        sp.variant("add_operator", fa2_2.operator_param.make(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=1)),
+    ]).run(sender=fa2_admin.address)
+    fa2_1.update_operators(
+      [sp.variant("add_operator", fa2_2.operator_param.make(
+          owner=sp.test_account("Alice").address,
+          operator=swapC.address,
+          token_id=2))]).run(sender=sp.test_account("Alice").address)
+    fa2_2.update_operators(
+      [sp.variant("add_operator", fa2_2.operator_param.make(
+          owner=sp.test_account("Alice").address,
+          operator=swapC.address,
+          token_id=0))]).run(sender=sp.test_account("Alice").address)
+
+    # FAIL: ownership of every token in the bundle is proven in one batch
+    swapC.propose_trade(sp.record(
+        mutez_amount1 = sp.tez(0),
+        mutez_amount2 = sp.tez(0),
+        tokens1 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(0),
+                royalty_addresses= sp.list([]),
+            ),
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(2),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        tokens2 = sp.list([
+            sp.record(
+                amount= sp.nat(4),
+                fa2= fa2_2.address,
+                id= sp.nat(0),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        proposer = fa2_admin.address,
+        acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
+    )).run(
+        sender = fa2_admin.address,
+        valid = False,
+        exception = 'FA2_NOT_OPERATOR'
+    )
+
+    # propose two tokens of one contract for tokens of both contracts
+    swapC.propose_trade(sp.record(
+        mutez_amount1 = sp.tez(1),
+        mutez_amount2 = sp.tez(0),
+        tokens1 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(0),
+                royalty_addresses= sp.list([]),
+            ),
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(1),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        tokens2 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(2),
+                royalty_addresses= sp.list([]),
+            ),
+            sp.record(
+                amount= sp.nat(4),
+                fa2= fa2_2.address,
+                id= sp.nat(0),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        proposer = fa2_admin.address,
+        acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
+    )).run(
+        sender = fa2_admin.address,
+        amount = sp.tez(1),
+    )
+
+    # FAIL: every FA2 contract of the bundle is checked against the denylist
+    swapC.modify_denylist(sp.record(
+        contract = fa2_2.address,
+        deny = True,
+    )).run(
+        sender = fa2_admin.address,
+    )
+    swapC.accept_trade(0).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(0),
+      valid=False,
+      exception='The contract is on the denylist'
+    )
+    swapC.modify_denylist(sp.record(
+        contract = fa2_2.address,
+        deny = False,
+    )).run(
+        sender = fa2_admin.address,
+    )
+
+    # accept the trade, every token of a FA2 contract moves in one transfer
+    swapC.accept_trade(0).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(0),
+    )
+
+    # verify that every token of the bundle swapped parties
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=0)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=1)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=2)) == 1)
+    scenario.verify(fa2_2.data.ledger[(fa2_admin.address, sp.nat(0))].balance == 4)
+    scenario.verify(fa2_2.data.ledger[(sp.test_account("Alice").address, sp.nat(0))].balance == 6)
+    # verify the contract holds no balance of tez now
+    scenario.verify(swapC.balance == sp.mutez(0))
+
+@sp.add_test(name = "Propose and accept a batch of trades")
+def test_propose_trades():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the FA2 contract
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    scenario += fa2_1
+
+    # Instantiate the swap contract
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+    )
+    scenario += swapC
+
+    # Mint tokens 0 and 1 for admin and tokens 2 and 3 for alice
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[
+            sp.record(
+              to_=sp.test_account("Alice").address,
+              token_id=2,
+              amount=1
+            ),
+            sp.record(
+              to_=sp.test_account("Alice").address,
+              token_id=3,
+              amount=1
+            ),
+          ]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # allow the swap contract to operate on the offered tokens
+    fa2_1.update_operators([
+        sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=0)),
+        sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=1)),
+    ]).run(sender=fa2_admin.address)
+
+    # each listing offers one of the admin's tokens for one of alice's tokens
+    proposals = sp.list([
+        sp.record(
+            mutez_amount1 = sp.tez(1),
+            mutez_amount2 = sp.tez(1),
+            tokens1 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(0),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            tokens2 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(2),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            proposer = fa2_admin.address,
+            acceptor = swapC.address,
+            expires_at = sp.none,
+            divisible = False,
+        ),
+        sp.record(
+            mutez_amount1 = sp.tez(2),
+            mutez_amount2 = sp.tez(1),
+            tokens1 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(1),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            tokens2 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(3),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            proposer = fa2_admin.address,
+            acceptor = swapC.address,
+            expires_at = sp.none,
+            divisible = False,
+        ),
+    ])
+
+    # FAIL: the sent tez must cover every proposal of the batch
+    swapC.propose_trades(proposals).run(
+        sender = fa2_admin.address,
+        amount = sp.tez(1),
+        valid = False,
+        exception = "The sent tez amount does not coincide trade proposal amount with 5% royalties"
+    )
+
+    # FAIL: every proposal of the batch must come from the sender
+    swapC.propose_trades(proposals).run(
+        sender = sp.test_account("Alice").address,
+        amount = sp.tez(3),
+        valid = False,
+        exception = "This can only be executed by the trade proposer"
+    )
+
+    # propose both trades in one operation
+    swapC.propose_trades(proposals).run(
+        sender = fa2_admin.address,
+        amount = sp.tez(3),
+    )
+
+    # verify the trades got consecutive ids and the tez is in custody
+    scenario.verify(swapC.get_counter() == 2)
+    scenario.verify(swapC.get_trade(0).proposal.mutez_amount1 == sp.tez(1))
+    scenario.verify(swapC.get_trade(1).proposal.mutez_amount1 == sp.tez(2))
+    scenario.verify(sp.len(swapC.get_trades(sp.record(from_ = 0, count = 10))) == 2)
+    scenario.verify(swapC.balance == sp.tez(3))
+
+    # verify that admin still owns both offered tokens
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=0)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=1)) == 1)
+
+    # allow the swap contract to operate on alice's tokens
+    fa2_1.update_operators([
+        sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=2)),
+        sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=3)),
+    ]).run(sender=sp.test_account("Alice").address)
+
+    # FAIL: the sent tez must cover every trade of the batch
+    swapC.accept_trades([0, 1]).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+      valid=False,
+      exception="The sent tez amount does not coincide trade proposal amount with 5% royalties"
+    )
+
+    # FAIL: the whole batch fails if a single trade can not be accepted
+    swapC.accept_trades([0, 1, 0]).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(3),
+      valid=False,
+    )
+
+    # sweep both listings in one operation
+    swapC.accept_trades([0, 1]).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(2),
+    )
+
+    # verify that every token swapped parties
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=0)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=1)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=2)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=3)) == 1)
+    # verify the contract holds no balance of tez now
+    scenario.verify(swapC.balance == sp.mutez(0))
+
+    # verify the views no longer return the finished trades
+    scenario.verify(sp.len(swapC.get_trades(sp.record(from_ = 0, count = 10))) == 0)
+
+@sp.add_test(name = "Accept a trade with pulled royalties")
+def test_pull_royalties():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the FA2 contract
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    scenario += fa2_1
+
+    # Instantiate the swap contract crediting royalties instead of sending them
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+      pull_royalties=True,
+    )
+    scenario += swapC
+
+    # Mint some tokens for the involved users, admin token 0 and alice token 1
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[sp.record(
+            to_=sp.test_account("Alice").address,
+            token_id=1,
+            amount=1
+          )]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # allow the swap contract to operate on both tokens
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=0))]).run(sender=fa2_admin.address)
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=1))]).run(sender=sp.test_account("Alice").address)
+
+    # propose a trade where Johnny earns royalties on both sides
+    swapC.propose_trade(sp.record(
+        mutez_amount1 = sp.tez(1),
+        mutez_amount2 = sp.tez(2),
+        tokens1 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(0),
+                royalty_addresses= sp.list([
+                    sp.test_account("Johnny").address,
+                ]),
+            )
+        ]),
+        tokens2 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(1),
+                royalty_addresses= sp.list([
+                    sp.test_account("Johnny").address,
+                    sp.test_account("Jane").address,
+                ]),
+            )
+        ]),
+        proposer = fa2_admin.address,
+        acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
+    )).run(
+        sender = fa2_admin.address,
+        amount = sp.tez(1),
+    )
+
+    swapC.accept_trade(0).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(2),
+    )
+
+    # verify the royalties stay in the contract, credited to each recipient
+    scenario.verify(swapC.data.royalty_balances[sp.test_account("Johnny").address] == sp.mutez(100000))
+    scenario.verify(swapC.data.royalty_balances[sp.test_account("Jane").address] == sp.mutez(50000))
+    scenario.verify(swapC.balance == sp.mutez(150000))
+
+    # FAIL: only an admin can push royalties
+    swapC.distribute_royalties([sp.test_account("Jane").address]).run(
+      sender=sp.test_account("Robert").address,
+      valid=False,
+      exception='NOT_ADMIN'
+    )
+
+    # FAIL: nothing to withdraw for someone without royalties
+    swapC.withdraw_royalties().run(
+      sender=sp.test_account("Robert").address,
+      valid=False,
+      exception='There are no royalties to withdraw'
+    )
+
+    # Johnny collects everything at once, an admin pushes Jane's cut
+    swapC.withdraw_royalties().run(sender=sp.test_account("Johnny").address)
+    swapC.distribute_royalties([
+      sp.test_account("Jane").address,
+      sp.test_account("Robert").address,
+    ]).run(sender=fa2_admin.address)
+
+    # verify every royalty has been paid out
+    scenario.verify(~swapC.data.royalty_balances.contains(sp.test_account("Johnny").address))
+    scenario.verify(~swapC.data.royalty_balances.contains(sp.test_account("Jane").address))
+    scenario.verify(swapC.balance == sp.mutez(0))
+
+@sp.add_test(name = "Propose and accept a trade commitment")
+def test_trade_commitment():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the FA2 contract
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    scenario += fa2_1
+
+    # Instantiate the swap contract
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+    )
+    scenario += swapC
+
+    # Mint some tokens for the involved users, admin token 0 and alice token 1
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[sp.record(
+            to_=sp.test_account("Alice").address,
+            token_id=1,
+            amount=1
+          )]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # allow the swap contract to operate on both tokens
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=0))]).run(sender=fa2_admin.address)
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=1))]).run(sender=sp.test_account("Alice").address)
+
+    proposal = sp.record(
+        mutez_amount1 = sp.tez(1),
+        mutez_amount2 = sp.tez(2),
+        tokens1 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(0),
+                royalty_addresses= sp.list([
+                    sp.test_account("Johnny").address,
+                ]),
+            )
+        ]),
+        tokens2 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(1),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        proposer = fa2_admin.address,
+        acceptor = swapC.address,
+        expires_at = sp.none,
+        divisible = False,
+    )
+
+    # only the digest of the proposal is stored
+    swapC.propose_trade_commitment(proposal).run(
+        sender = fa2_admin.address,
+        amount = sp.tez(1),
+    )
+    scenario.verify(swapC.data.counter == 1)
+    scenario.verify(~swapC.data.trades.contains(0))
+    scenario.verify(swapC.data.trade_commitments[0].escrow == sp.tez(1))
+    scenario.verify(swapC.balance == sp.tez(1))
+
+    # FAIL: the acceptor can not change the committed proposal
+    swapC.accept_trade_commitment(sp.record(
+        trade_id = 0,
+        proposal = sp.record(
+            mutez_amount1 = sp.tez(1),
+            mutez_amount2 = sp.tez(0),
+            tokens1 = proposal.tokens1,
+            tokens2 = proposal.tokens2,
+            proposer = fa2_admin.address,
+            acceptor = swapC.address,
+            expires_at = sp.none,
+            divisible = False,
+        ),
+    )).run(
+      sender=sp.test_account("Alice").address,
+      valid=False,
+      exception="The trade proposal does not match the commitment"
+    )
+
+    # FAIL: only the proposer can cancel the commitment
+    swapC.cancel_trade_commitment(sp.record(trade_id = 0, proposal = proposal)).run(
+      sender=sp.test_account("Alice").address,
+      valid=False,
+      exception="This can only be executed by the trade proposer"
+    )
+
+    # accept the commitment by providing the full proposal
+    swapC.accept_trade_commitment(sp.record(trade_id = 0, proposal = proposal)).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(2),
+    )
+
+    # verify the tokens swapped and the commitment is gone
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=1)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=0)) == 1)
+    scenario.verify(~swapC.data.trade_commitments.contains(0))
+    scenario.verify(swapC.balance == sp.mutez(0))
+
+@sp.add_test(name = "Compare stored trade sizes")
+def test_trade_status_size():
+    # Create a scenario
+    scenario = sp.test_scenario()
+    scenario.h1("Packed bytes per stored trade, status booleans vs no status")
+
+    swapType = swapContractKYC.XTZFA2Swap
+
+    # the stored trade layout from before finished trades were removed
+    legacy_trade_type = sp.TRecord(
+        proposer_accepted=sp.TBool,
+        acceptor_accepted=sp.TBool,
+        executed=sp.TBool,
+        executor=sp.TAddress,
+        royalties1=swapType.ROYALTY_SPLIT_TYPE,
+        royalties2=swapType.ROYALTY_SPLIT_TYPE,
+        epoch=sp.TNat,
+        proposal=swapType.TRADE_PROPOSAL_TYPE
+    )
+
+    # a typical open KYC trade with one token and royalty address per side
+    royalties = sp.record(
+        shares={sp.test_account("Johnny").address: 1},
+        denominator=1)
+    proposal = sp.record(
+        mutez_amount1 = sp.tez(1),
+        mutez_amount2 = sp.tez(2),
+        tokens1 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= sp.address("KT1Kbw5BZLW6Ju6XAmPJyjDuSMQKKBQHGzdi"),
+                id= sp.nat(0),
+                royalty_addresses= sp.list([sp.test_account("Johnny").address]),
+            )
+        ]),
+        tokens2 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= sp.address("KT1Kbw5BZLW6Ju6XAmPJyjDuSMQKKBQHGzdi"),
+                id= sp.nat(1),
+                royalty_addresses= sp.list([sp.test_account("Johnny").address]),
+            )
+        ]),
+        proposer = sp.test_account("Administrator").address,
+        acceptor = sp.test_account("Alice").address,
+        expires_at = sp.none,
+        divisible = False,
+    )
+
+    legacy_size = sp.len(sp.pack(sp.set_type_expr(sp.record(
+        proposer_accepted=True,
+        acceptor_accepted=False,
+        executed=False,
+        executor=sp.address("KT1Kbw5BZLW6Ju6XAmPJyjDuSMQKKBQHGzdi"),
+        royalties1=royalties,
+        royalties2=royalties,
+        epoch=0,
+        proposal=proposal), legacy_trade_type)))
+    trade_size = sp.len(sp.pack(sp.set_type_expr(sp.record(
+        royalties1=royalties,
+        royalties2=royalties,
+        epoch=0,
+        proposal=proposal), swapType.TRADE_TYPE)))
+
+    scenario.h2("Status booleans and executor")
+    scenario.show(legacy_size)
+    scenario.h2("Stored trade, the status is only emitted in events")
+    scenario.show(trade_size)
+
+    # dropping the status must shrink every stored trade
+    scenario.verify(trade_size < legacy_size)
+
+@sp.add_test(name = "Expire and sweep trades")
+def test_sweep_expired():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the FA2 contract
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    scenario += fa2_1
+
+    # Instantiate the swap contract
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+    )
+    scenario += swapC
+
+    # Mint some tokens for the involved users, admin token 0 and alice token 1
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[sp.record(
+            to_=sp.test_account("Alice").address,
+            token_id=1,
+            amount=1
+          )]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # allow the swap contract to operate on both tokens
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=0))]).run(sender=fa2_admin.address)
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=1))]).run(sender=sp.test_account("Alice").address)
+
+    # propose a trade that expires and one that doesn't
+    swapC.propose_trades(sp.list([
+        sp.record(
+            mutez_amount1 = sp.tez(1),
+            mutez_amount2 = sp.tez(0),
+            tokens1 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(0),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            tokens2 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(1),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            proposer = fa2_admin.address,
+            acceptor = swapC.address,
+            expires_at = sp.some(sp.timestamp(100)),
+            divisible = False,
+        ),
+        sp.record(
+            mutez_amount1 = sp.tez(2),
+            mutez_amount2 = sp.tez(0),
+            tokens1 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(0),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            tokens2 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(1),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            proposer = fa2_admin.address,
+            acceptor = swapC.address,
+            expires_at = sp.none,
+            divisible = False,
+        ),
+    ])).run(
+        sender = fa2_admin.address,
+        amount = sp.tez(3),
+        now = sp.timestamp(0),
+    )
+
+    # FAIL: the first trade can not be accepted once it expired
+    swapC.accept_trade(0).run(
+      sender=sp.test_account("Alice").address,
+      now=sp.timestamp(100),
+      valid=False,
+      exception="The trade has expired"
+    )
+
+    # nothing is swept when the limit is zero
+    swapC.sweep_expired(sp.record(trade_ids = [0, 1], limit = 0)).run(
+      sender=sp.test_account("Robert").address,
+      now=sp.timestamp(100),
+    )
+    scenario.verify(swapC.data.trades.contains(0))
+
+    # anyone can sweep, the trade that never expires is skipped
+    swapC.sweep_expired(sp.record(trade_ids = [0, 1, 7], limit = 10)).run(
+      sender=sp.test_account("Robert").address,
+      now=sp.timestamp(100),
+    )
+    scenario.verify(~swapC.data.trades.contains(0))
+    scenario.verify(swapC.data.trades.contains(1))
+
+    # verify the proposer got back the tez of the expired trade only
+    scenario.verify(swapC.balance == sp.tez(2))
+
+@sp.add_test(name = "Invalidate the other trades of traded tokens")
+def test_trades_by_token():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the FA2 contract
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    scenario += fa2_1
+
+    # Instantiate the swap contract
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+    )
+    scenario += swapC
+
+    # Mint some tokens, admin token 0, alice token 1 and robert token 2
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[
+            sp.record(
+              to_=sp.test_account("Alice").address,
+              token_id=1,
+              amount=1
+            ),
+            sp.record(
+              to_=sp.test_account("Robert").address,
+              token_id=2,
+              amount=1
+            ),
+          ]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # allow the swap contract to operate on every token
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=0))]).run(sender=fa2_admin.address)
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=1))]).run(sender=sp.test_account("Alice").address)
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Robert").address,
+            operator=swapC.address,
+            token_id=2))]).run(sender=sp.test_account("Robert").address)
+
+    # admin lists token 0 twice, for token 1 and for token 2
+    swapC.propose_trades(sp.list([
+        sp.record(
+            mutez_amount1 = sp.tez(1),
+            mutez_amount2 = sp.tez(0),
+            tokens1 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(0),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            tokens2 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(1),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            proposer = fa2_admin.address,
+            acceptor = swapC.address,
+            expires_at = sp.none,
+            divisible = False,
+        ),
+        sp.record(
+            mutez_amount1 = sp.tez(2),
+            mutez_amount2 = sp.tez(0),
+            tokens1 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(0),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            tokens2 = sp.list([
+                sp.record(
+                    amount= sp.nat(1),
+                    fa2= fa2_1.address,
+                    id= sp.nat(2),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            proposer = fa2_admin.address,
+            acceptor = swapC.address,
+            expires_at = sp.none,
+            divisible = False,
+        ),
+    ])).run(
+        sender = fa2_admin.address,
+        amount = sp.tez(3),
+    )
+
+    # robert asks for token 0 in exchange of token 2
+    swapC.propose_trade(sp.record(
+        mutez_amount1 = sp.tez(0),
+        mutez_amount2 = sp.tez(0),
+        tokens1 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(2),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        tokens2 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(0),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        proposer = sp.test_account("Robert").address,
+        acceptor = swapC.address,
+        expires_at = sp.none,
+        divisible = False,
+    )).run(
+        sender = sp.test_account("Robert").address,
+    )
+
+    # verify the trades that offer a token are indexed under it
+    scenario.verify(swapC.get_trades_by_token(sp.pair(fa2_1.address, 0)) == sp.set([0, 1]))
+    scenario.verify(~swapC.data.trades_by_token.contains(sp.pair(fa2_1.address, 1)))
+    scenario.verify(swapC.get_trades_by_token(sp.pair(fa2_1.address, 2)) == sp.set([2]))
+
+    # verify the requests are kept one key per token and trade
+    scenario.verify(swapC.is_token_requested(sp.record(token=sp.pair(fa2_1.address, 0), trade_id=2)))
+    scenario.verify(swapC.is_token_requested(sp.record(token=sp.pair(fa2_1.address, 1), trade_id=0)))
+    scenario.verify(swapC.is_token_requested(sp.record(token=sp.pair(fa2_1.address, 2), trade_id=1)))
+    scenario.verify(~swapC.is_token_requested(sp.record(token=sp.pair(fa2_1.address, 0), trade_id=0)))
+
+    # verify only the trades that offer token 0 are indexed by its owner
+    scenario.verify(swapC.data.offers_by_owner[sp.pair(fa2_admin.address, sp.pair(fa2_1.address, 0))] == sp.set([0, 1]))
+    scenario.verify(~swapC.data.offers_by_owner.contains(sp.pair(sp.test_account("Robert").address, sp.pair(fa2_1.address, 0))))
+
+    # alice buys token 0
+    swapC.accept_trade(0).run(
+      sender=sp.test_account("Alice").address,
+    )
+
+    # verify the tokens swapped parties
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=0)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=1)) == 1)
+
+    # verify the other listing of token 0 by admin is gone and its tez were
+    # given back, while robert's request for token 0 stays open
+    scenario.verify(~swapC.data.trades.contains(1))
+    scenario.verify(swapC.data.trades.contains(2))
+    scenario.verify(swapC.balance == sp.mutez(0))
+
+    # verify the indexes only keep the open trade
+    scenario.verify(~swapC.data.trades_by_token.contains(sp.pair(fa2_1.address, 0)))
+    scenario.verify(swapC.get_trades_by_token(sp.pair(fa2_1.address, 2)) == sp.set([2]))
+    scenario.verify(swapC.is_token_requested(sp.record(token=sp.pair(fa2_1.address, 0), trade_id=2)))
+    scenario.verify(~swapC.is_token_requested(sp.record(token=sp.pair(fa2_1.address, 1), trade_id=0)))
+    scenario.verify(~swapC.is_token_requested(sp.record(token=sp.pair(fa2_1.address, 2), trade_id=1)))
+    scenario.verify(~swapC.data.offers_by_owner.contains(sp.pair(fa2_admin.address, sp.pair(fa2_1.address, 0))))
+
+    # FAIL: the invalidated listing can not be accepted anymore
+    swapC.accept_trade(1).run(
+      sender=sp.test_account("Robert").address,
+      valid=False,
+      exception="The provided trade id doesn't exist"
+    )
+
+@sp.add_test(name = "Invalidate the other trades of traded editions")
+def test_invalidate_traded_editions():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the FA2 contract
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    scenario += fa2_1
+
+    # Instantiate the swap contract
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+    )
+    scenario += swapC
+
+    # Mint 100 editions of token 0 and a single token 1 for admin, and 100
+    # editions of token 2 for alice
+    fa2_1.mint(amount=sp.nat(100)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(100)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[sp.record(
+            to_=sp.test_account("Alice").address,
+            token_id=2,
+            amount=100
+          )]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # allow the swap contract to operate on every token
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=0)),
+         sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=1))]).run(sender=fa2_admin.address)
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=2))]).run(sender=sp.test_account("Alice").address)
+
+    # admin offers some editions of a token for some editions of token 2
+    def offer(token_id, amount, price, divisible):
+        return sp.record(
+            mutez_amount1 = sp.tez(0),
+            mutez_amount2 = sp.tez(0),
+            tokens1 = sp.list([
+                sp.record(
+                    amount= sp.nat(amount),
+                    fa2= fa2_1.address,
+                    id= sp.nat(token_id),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            tokens2 = sp.list([
+                sp.record(
+                    amount= sp.nat(price),
+                    fa2= fa2_1.address,
+                    id= sp.nat(2),
+                    royalty_addresses= sp.list([]),
+                )
+            ]),
+            proposer = fa2_admin.address,
+            acceptor = swapC.address,
+            expires_at = sp.none,
+            divisible = divisible,
+        )
+
+    # admin lists token 0 four times and token 1 twice, once as divisible
+    swapC.propose_trades(sp.list([
+        offer(0, 1, 1, False),
+        offer(0, 50, 2, True),
+        offer(0, 1, 1, False),
+        offer(0, 10, 1, False),
+        offer(1, 1, 1, True),
+        offer(1, 1, 1, False),
+    ])).run(
+        sender = fa2_admin.address,
+    )
+    scenario.verify(swapC.data.offers_by_owner[sp.pair(fa2_admin.address, sp.pair(fa2_1.address, 0))] == sp.set([0, 1, 2, 3]))
+    scenario.verify(swapC.data.offers_by_owner[sp.pair(fa2_admin.address, sp.pair(fa2_1.address, 1))] == sp.set([4, 5]))
+
+    # alice buys a single edition of token 0
+    swapC.accept_trade(0).run(
+      sender=sp.test_account("Alice").address,
+    )
+
+    # verify only the other listing of a single edition is gone, admin may
+    # still hold enough editions for the larger ones
+    scenario.verify(~swapC.data.trades.contains(2))
+    scenario.verify(swapC.data.trades.contains(1))
+    scenario.verify(swapC.data.trades.contains(3))
+    scenario.verify(swapC.data.offers_by_owner[sp.pair(fa2_admin.address, sp.pair(fa2_1.address, 0))] == sp.set([1, 3]))
+
+    # alice buys half of the divisible listing, 25 editions
+    swapC.accept_trade_partial(sp.record(trade_id = 1, numerator = 1, denominator = 2)).run(
+      sender=sp.test_account("Alice").address,
+    )
+
+    # verify the listing of 10 editions is gone and the remainder stays open
+    scenario.verify(~swapC.data.trades.contains(3))
+    scenario.verify(swapC.data.trades.contains(1))
+    scenario.verify(swapC.data.offers_by_owner[sp.pair(fa2_admin.address, sp.pair(fa2_1.address, 0))] == sp.set([1]))
+
+    # alice buys token 1 through the divisible listing
+    swapC.accept_trade(4).run(
+      sender=sp.test_account("Alice").address,
+    )
+
+    # verify the divisible flag does not protect the other listing of token 1
+    scenario.verify(~swapC.data.trades.contains(5))
+    scenario.verify(~swapC.data.offers_by_owner.contains(sp.pair(fa2_admin.address, sp.pair(fa2_1.address, 1))))
+
+    # verify the tokens swapped parties
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=0)) == 26)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=1)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=2)) == 3)
+
+    # FAIL: the invalidated listing can not be accepted anymore
+    swapC.accept_trade(2).run(
+      sender=sp.test_account("Alice").address,
+      valid=False,
+      exception="The provided trade id doesn't exist"
+    )
+
+@sp.add_test(name = "Amend a trade")
+def test_amend_trade():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the FA2 contract
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    scenario += fa2_1
+
+    # Instantiate the swap contract
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+    )
+    scenario += swapC
+
+    # Mint some tokens for the involved users, admin token 0 and alice token 1
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[sp.record(
+            to_=sp.test_account("Alice").address,
+            token_id=1,
+            amount=1
+          )]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # allow the swap contract to operate on both tokens
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=0))]).run(sender=fa2_admin.address)
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=1))]).run(sender=sp.test_account("Alice").address)
+
+    # propose an anon trade with 1 tez in custody
+    swapC.propose_trade(sp.record(
+        mutez_amount1 = sp.tez(1),
+        mutez_amount2 = sp.tez(0),
+        tokens1 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(0),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        tokens2 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(1),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        proposer = fa2_admin.address,
+        acceptor = swapC.address,
+        expires_at = sp.none,
+        divisible = False,
+    )).run(
+        sender = fa2_admin.address,
+        amount = sp.tez(1),
+    )
+
+    # FAIL: only the proposer can amend the trade
+    swapC.amend_trade(sp.record(
+        trade_id = 0,
+        mutez_amount1 = sp.tez(0),
+        mutez_amount2 = sp.tez(0),
+        acceptor = sp.none,
+    )).run(
+      sender=sp.test_account("Alice").address,
+      valid=False,
+      exception="This can only be executed by the trade proposer"
+    )
+
+    # FAIL: raising the tez in custody needs exactly the difference
+    swapC.amend_trade(sp.record(
+        trade_id = 0,
+        mutez_amount1 = sp.tez(3),
+        mutez_amount2 = sp.tez(0),
+        acceptor = sp.none,
+    )).run(
+      sender=fa2_admin.address,
+      amount=sp.tez(3),
+      valid=False,
+      exception="The sent tez amount does not coincide with the trade proposal amount increase"
+    )
+
+    # FAIL: the acceptor can not be the proposer
+    swapC.amend_trade(sp.record(
+        trade_id = 0,
+        mutez_amount1 = sp.tez(1),
+        mutez_amount2 = sp.tez(0),
+        acceptor = sp.some(fa2_admin.address),
+    )).run(
+      sender=fa2_admin.address,
+      valid=False,
+      exception="The users involved in the trade need to be different"
+    )
+
+    # raise the tez in custody by sending the difference only
+    swapC.amend_trade(sp.record(
+        trade_id = 0,
+        mutez_amount1 = sp.tez(3),
+        mutez_amount2 = sp.tez(0),
+        acceptor = sp.none,
+    )).run(
+      sender=fa2_admin.address,
+      amount=sp.tez(2),
+    )
+    scenario.verify(swapC.data.trades[0].proposal.mutez_amount1 == sp.tez(3))
+    scenario.verify(swapC.balance == sp.tez(3))
+
+    # lower it again, ask alice for 1 tez and make it a KYC trade for her
+    swapC.amend_trade(sp.record(
+        trade_id = 0,
+        mutez_amount1 = sp.mutez(500000),
+        mutez_amount2 = sp.tez(1),
+        acceptor = sp.some(sp.test_account("Alice").address),
+    )).run(
+      sender=fa2_admin.address,
+    )
+
+    # verify the difference was given back and the trade kept its id
+    scenario.verify(swapC.balance == sp.mutez(500000))
+    scenario.verify(swapC.get_counter() == 1)
+    scenario.verify(swapC.data.trades[0].proposal.acceptor == sp.test_account("Alice").address)
+    scenario.verify(swapC.get_trades_by_user(sp.test_account("Alice").address).contains(0))
+
+    # FAIL: robert is not the acceptor anymore
+    swapC.accept_trade(0).run(
+      sender=sp.test_account("Robert").address,
+      amount=sp.tez(1),
+      valid=False,
+      exception="This can only be executed by the trade acceptor"
+    )
+
+    # alice accepts the amended trade
+    swapC.accept_trade(0).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+    )
+
+    # verify the tokens swapped parties and no tez is left in custody
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=0)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=1)) == 1)
+    scenario.verify(swapC.balance == sp.mutez(0))
+
+@sp.add_test(name = "Partially accept a divisible trade")
+def test_accept_trade_partial():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the FA2 contract
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    scenario += fa2_1
+
+    # Instantiate the swap contract
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+    )
+    scenario += swapC
+
+    # Mint 100 editions of token 0 for admin and 10 editions of token 1 for alice
+    fa2_1.mint(amount=sp.nat(100)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(10)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[sp.record(
+            to_=sp.test_account("Alice").address,
+            token_id=1,
+            amount=10
+          )]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # allow the swap contract to operate on both tokens
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=0))]).run(sender=fa2_admin.address)
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=1))]).run(sender=sp.test_account("Alice").address)
+
+    # admin sells the 100 editions of token 0 for 10 editions of token 1 and 10 tez
+    swapC.propose_trade(sp.record(
+        mutez_amount1 = sp.tez(0),
+        mutez_amount2 = sp.tez(10),
+        tokens1 = sp.list([
+            sp.record(
+                amount= sp.nat(100),
+                fa2= fa2_1.address,
+                id= sp.nat(0),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        tokens2 = sp.list([
+            sp.record(
+                amount= sp.nat(10),
+                fa2= fa2_1.address,
+                id= sp.nat(1),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        proposer = fa2_admin.address,
+        acceptor = swapC.address,
+        expires_at = sp.none,
+        divisible = True,
+    )).run(
+        sender = fa2_admin.address,
+    )
+
+    # FAIL: the whole trade has to be accepted with accept_trade
+    swapC.accept_trade_partial(sp.record(trade_id = 0, numerator = 1, denominator = 1)).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(10),
+      valid=False,
+      exception="The fraction must be strictly between 0 and 1"
+    )
+
+    # FAIL: a quarter of 10 editions is not a whole number of editions
+    swapC.accept_trade_partial(sp.record(trade_id = 0, numerator = 1, denominator = 4)).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.mutez(2500000),
+      valid=False,
+      exception="The fraction does not divide the token amounts"
+    )
+
+    # FAIL: the tez have to be scaled too
+    swapC.accept_trade_partial(sp.record(trade_id = 0, numerator = 1, denominator = 10)).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(10),
+      valid=False,
+      exception="The sent tez amount does not coincide trade proposal amount with 5% royalties"
+    )
+
+    # alice buys a tenth of the trade
+    swapC.accept_trade_partial(sp.record(trade_id = 0, numerator = 1, denominator = 10)).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+    )
+
+    # verify a tenth of the editions swapped parties
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=0)) == 10)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=0)) == 90)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=1)) == 1)
+
+    # verify the remainder is still open under the same id
+    scenario.verify(swapC.data.trades.contains(0))
+    scenario.verify(swapC.data.trades[0].proposal.mutez_amount2 == sp.tez(9))
+    scenario.verify(sp.pack(swapC.data.trades[0].proposal.tokens1) == sp.pack(sp.set_type_expr(sp.list([
+        sp.record(
+            amount= sp.nat(90),
+            fa2= fa2_1.address,
+            id= sp.nat(0),
+            royalty_addresses= sp.list([]),
+        )
+    ]), sp.TList(swapContractKYC.XTZFA2Swap.TOKEN_TYPE))))
+    scenario.verify(sp.pack(swapC.data.trades[0].proposal.tokens2) == sp.pack(sp.set_type_expr(sp.list([
+        sp.record(
+            amount= sp.nat(9),
+            fa2= fa2_1.address,
+            id= sp.nat(1),
+            royalty_addresses= sp.list([]),
+        )
+    ]), sp.TList(swapContractKYC.XTZFA2Swap.TOKEN_TYPE))))
+    scenario.verify(swapC.get_counter() == 1)
+
+    # alice buys the remainder
+    swapC.accept_trade(0).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(9),
+    )
+
+    # verify every edition swapped parties and the trade is finished
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=0)) == 100)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=1)) == 10)
+    scenario.verify(~swapC.data.trades.contains(0))
+    scenario.verify(swapC.balance == sp.mutez(0))
+
+@sp.add_test(name = "Invalidate all my trades and refund them")
+def test_invalidate_all_my_trades():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the FA2 contract
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    scenario += fa2_1
+
+    # Instantiate the swap contract
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+    )
+    scenario += swapC
+
+    # Mint some tokens for the involved users, admin token 0 and alice token 1
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[sp.record(
+            to_=sp.test_account("Alice").address,
+            token_id=1,
+            amount=1
+          )]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # allow the swap contract to operate on both tokens
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=0))]).run(sender=fa2_admin.address)
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=1))]).run(sender=sp.test_account("Alice").address)
+
+    proposal = sp.record(
+        mutez_amount1 = sp.tez(1),
+        mutez_amount2 = sp.tez(0),
+        tokens1 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(0),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        tokens2 = sp.list([
+            sp.record(
+                amount= sp.nat(1),
+                fa2= fa2_1.address,
+                id= sp.nat(1),
+                royalty_addresses= sp.list([]),
+            )
+        ]),
+        proposer = fa2_admin.address,
+        acceptor = swapC.address,
+        expires_at = sp.none,
+        divisible = False,
+    )
+
+    # admin lists token 0 twice
+    swapC.propose_trades(sp.list([proposal, proposal])).run(
+        sender = fa2_admin.address,
+        amount = sp.tez(2),
+    )
+    scenario.verify(swapC.data.trades[0].epoch == 0)
+
+    # FAIL: tez can not be sent along
+    swapC.invalidate_all_my_trades().run(
+      sender=fa2_admin.address,
+      amount=sp.tez(1),
+      valid=False,
+      exception="The operation does not need tez"
+    )
+
+    # admin invalidates every trade they proposed so far in one call
+    swapC.invalidate_all_my_trades().run(
+      sender=fa2_admin.address,
+    )
+    scenario.verify(swapC.get_proposer_epoch(fa2_admin.address) == 1)
+
+    # FAIL: the invalidated trades can not be accepted anymore
+    swapC.accept_trade(0).run(
+      sender=sp.test_account("Alice").address,
+      valid=False,
+      exception="The trade was invalidated by its proposer"
+    )
+
+    # trades proposed afterwards get the new epoch
+    swapC.propose_trade(proposal).run(
+        sender = fa2_admin.address,
+        amount = sp.tez(1),
+    )
+    scenario.verify(swapC.data.trades[2].epoch == 1)
+
+    # anyone can refund the invalidated trades, the current and unknown ones are skipped
+    swapC.refund_stale([0, 1, 2, 7]).run(
+      sender=sp.test_account("Robert").address,
+    )
+    scenario.verify(~swapC.data.trades.contains(0))
+    scenario.verify(~swapC.data.trades.contains(1))
+    scenario.verify(swapC.data.trades.contains(2))
+
+    # verify only the tez of the current trade is still in custody
+    scenario.verify(swapC.balance == sp.tez(1))
+
+    # admin also lists token 0 as a commitment in the current epoch
+    swapC.propose_trade_commitment(proposal).run(
+        sender = fa2_admin.address,
+        amount = sp.tez(1),
+    )
+    scenario.verify(swapC.data.trade_commitments[3].epoch == 1)
+
+    # the current trade can still be accepted
+    swapC.accept_trade(2).run(
+      sender=sp.test_account("Alice").address,
+    )
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=0)) == 1)
+    scenario.verify(swapC.balance == sp.tez(1))
+
+    # admin invalidates the commitment with everything else
+    swapC.invalidate_all_my_trades().run(
+      sender=fa2_admin.address,
+    )
+
+    # FAIL: the invalidated commitment can not be accepted anymore
+    swapC.accept_trade_commitment(sp.record(trade_id = 3, proposal = proposal)).run(
+      sender=sp.test_account("Robert").address,
+      valid=False,
+      exception="The trade was invalidated by its proposer"
+    )
+
+    # anyone can refund the invalidated commitment, unknown ids are skipped
+    swapC.refund_stale_commitments([
+        sp.record(trade_id = 3, proposal = proposal),
+        sp.record(trade_id = 7, proposal = proposal),
+    ]).run(
+      sender=sp.test_account("Robert").address,
+    )
+    scenario.verify(~swapC.data.trade_commitments.contains(3))
+    scenario.verify(swapC.balance == sp.mutez(0))
+
+@sp.add_test(name = "Accept a signed offer")
+def test_accept_signed_offer():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the FA2 contract
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    scenario += fa2_1
+
+    # Instantiate the swap contract
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+    )
+    scenario += swapC
+
+    swapType = swapContractKYC.XTZFA2Swap
+    chain_id = sp.chain_id_cst("0x9caecab9")
+
+    # Mint some tokens for the involved users, admin token 0 and alice token 1
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[sp.record(
+            to_=sp.test_account("Alice").address,
+            token_id=1,
+            amount=1
+          )]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # allow the swap contract to operate on both tokens
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=0))]).run(sender=fa2_admin.address)
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=1))]).run(sender=sp.test_account("Alice").address)
+
+    # admin signs an offer of token 0 for token 1 and 1 tez, nothing is stored
+    def make_offer(mutez_amount2, nonce):
+        return sp.record(
+            proposal = sp.record(
+                mutez_amount1 = sp.tez(0),
+                mutez_amount2 = mutez_amount2,
+                tokens1 = sp.list([
+                    sp.record(
+                        amount= sp.nat(1),
+                        fa2= fa2_1.address,
+                        id= sp.nat(0),
+                        royalty_addresses= sp.list([]),
+                    )
+                ]),
+                tokens2 = sp.list([
+                    sp.record(
+                        amount= sp.nat(1),
+                        fa2= fa2_1.address,
+                        id= sp.nat(1),
+                        royalty_addresses= sp.list([]),
+                    )
+                ]),
+                proposer = fa2_admin.address,
+                acceptor = swapC.address,
+                expires_at = sp.some(sp.timestamp(100)),
+                divisible = False,
+            ),
+            nonce = nonce,
+            epoch = 0,
+        )
+
+    def sign_offer(account, offer):
+        return sp.make_signature(
+            account.secret_key,
+            sp.pack(sp.set_type_expr(
+                sp.record(chain_id=chain_id, contract=swapC.address, offer=offer),
+                swapType.SIGNED_OFFER_MESSAGE_TYPE)),
+            message_format = "Raw")
+
+    offer = make_offer(sp.tez(1), 0)
+    signature = sign_offer(fa2_admin, offer)
+
+    # FAIL: the public key has to be the proposer's
+    swapC.accept_signed_offer(sp.record(
+        offer = offer,
+        signature = sign_offer(sp.test_account("Robert"), offer),
+        public_key = sp.test_account("Robert").public_key,
+    )).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+      now=sp.timestamp(0),
+      chain_id=chain_id,
+      valid=False,
+      exception="The public key does not match the proposer"
+    )
+
+    # FAIL: the acceptor can not change the signed offer
+    swapC.accept_signed_offer(sp.record(
+        offer = make_offer(sp.tez(0), 0),
+        signature = signature,
+        public_key = fa2_admin.public_key,
+    )).run(
+      sender=sp.test_account("Alice").address,
+      now=sp.timestamp(0),
+      chain_id=chain_id,
+      valid=False,
+      exception="The signature does not match the signed offer"
+    )
+
+    # FAIL: the offer can not be accepted once it expired
+    swapC.accept_signed_offer(sp.record(
+        offer = offer,
+        signature = signature,
+        public_key = fa2_admin.public_key,
+    )).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+      now=sp.timestamp(100),
+      chain_id=chain_id,
+      valid=False,
+      exception="The trade has expired"
+    )
+
+    # alice accepts the signed offer
+    swapC.accept_signed_offer(sp.record(
+        offer = offer,
+        signature = signature,
+        public_key = fa2_admin.public_key,
+    )).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+      now=sp.timestamp(0),
+      chain_id=chain_id,
+    )
+
+    # verify the tokens swapped parties and the nonce is used
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=0)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=1)) == 1)
+    scenario.verify(swapC.data.used_nonces.contains(sp.pair(fa2_admin.address, 0)))
+    scenario.verify(swapC.balance == sp.mutez(0))
+
+    # FAIL: the offer can only be used once
+    swapC.accept_signed_offer(sp.record(
+        offer = offer,
+        signature = signature,
+        public_key = fa2_admin.public_key,
+    )).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+      now=sp.timestamp(0),
+      chain_id=chain_id,
+      valid=False,
+      exception="The signed offer was already used or cancelled"
+    )
+
+    # admin cancels another offer before anyone accepts it
+    other_offer = make_offer(sp.tez(2), 1)
+    swapC.cancel_signed_offers([1]).run(
+      sender=fa2_admin.address,
+    )
+
+    # FAIL: the cancelled offer can not be accepted
+    swapC.accept_signed_offer(sp.record(
+        offer = other_offer,
+        signature = sign_offer(fa2_admin, other_offer),
+        public_key = fa2_admin.public_key,
+    )).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(2),
+      now=sp.timestamp(0),
+      chain_id=chain_id,
+      valid=False,
+      exception="The signed offer was already used or cancelled"
+    )
+
+def merkle_levels(leaves):
+    """Builds every level of a Merkle tree from its leaf hashes, the root
+    level last. Levels with an odd number of nodes repeat their last node.
+    """
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        if len(level) % 2 == 1:
+            level = level + [level[-1]]
+        levels.append([
+            sp.blake2b(sp.concat([level[i], level[i + 1]]))
+            for i in range(0, len(level), 2)])
+    return levels
+
+def merkle_proof(levels, index):
+    """Returns the sibling hashes from the leaf at index up to the root.
+    """
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        proof.append(level[sibling] if sibling < len(level) else level[index])
+        index //= 2
+    return proof
+
+@sp.add_test(name = "Accept offers from an offer root")
+def test_accept_from_root():
+    # Create a scenario
+    scenario = sp.test_scenario()
+
+    # pull out the fa2_admin into a smaller var
+    fa2_admin = sp.test_account("Administrator")
+
+    # Initialize the FA2 contract
+    fa2_1 = fa2Contract2.FA2(
+      administrator=fa2_admin.address,
+      metadata=sp.utils.metadata_of_url("ipfs://aaa"))
+    scenario += fa2_1
+
+    # Instantiate the swap contract
+    swapC = swapContractKYC.XTZFA2Swap(
+      administrator=fa2_admin.address,
+    )
+    scenario += swapC
+
+    swapType = swapContractKYC.XTZFA2Swap
+
+    # Mint a collection of tokens 0 to 4 for admin and 10 editions of token 5 for alice
+    for token_id in range(5):
+        fa2_1.mint(amount=sp.nat(1)).run(sender=fa2_admin.address)
+    fa2_1.mint(amount=sp.nat(10)).run(sender=fa2_admin.address)
+    fa2_1.transfer([
+      sp.record(
+          from_=fa2_admin.address,
+          txs=[sp.record(
+            to_=sp.test_account("Alice").address,
+            token_id=5,
+            amount=10
+          )]
+      )]).run(
+      sender=fa2_admin.address
+    )
+
+    # allow the swap contract to operate on every token
+    fa2_1.update_operators([
+        sp.variant("add_operator", sp.record(
+            owner=fa2_admin.address,
+            operator=swapC.address,
+            token_id=token_id)) for token_id in range(5)]).run(sender=fa2_admin.address)
+    fa2_1.update_operators(
+        [sp.variant("add_operator", sp.record(
+            owner=sp.test_account("Alice").address,
+            operator=swapC.address,
+            token_id=5))]).run(sender=sp.test_account("Alice").address)
+
+    # admin offers every token of the collection for an edition of token 5 and 1 tez
+    offers = [
+        sp.record(
+            index = index,
+            proposal = sp.record(
+                mutez_amount1 = sp.tez(0),
+                mutez_amount2 = sp.tez(1),
+                tokens1 = sp.list([
+                    sp.record(
+                        amount= sp.nat(1),
+                        fa2= fa2_1.address,
+                        id= sp.nat(index),
+                        royalty_addresses= sp.list([]),
+                    )
+                ]),
+                tokens2 = sp.list([
+                    sp.record(
+                        amount= sp.nat(1),
+                        fa2= fa2_1.address,
+                        id= sp.nat(5),
+                        royalty_addresses= sp.list([]),
+                    )
+                ]),
+                proposer = fa2_admin.address,
+                acceptor = swapC.address,
+                expires_at = sp.none,
+                divisible = False,
+            ),
+        ) for index in range(5)]
+    levels = merkle_levels([
+        sp.blake2b(sp.pack(sp.set_type_expr(offer, swapType.ROOT_OFFER_TYPE)))
+        for offer in offers])
+
+    # FAIL: there is nothing to accept before the root is committed
+    swapC.accept_from_root(sp.record(offer = offers[2], proof = merkle_proof(levels, 2))).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+      now=sp.timestamp(0),
+      valid=False,
+      exception="The proposer has no offer root"
+    )
+
+    # admin lists the whole collection in one call
+    swapC.commit_offer_root(sp.record(root = levels[-1][0], expiry = sp.timestamp(100))).run(
+      sender=fa2_admin.address,
+      now=sp.timestamp(0),
+    )
+
+    # FAIL: the proof has to be the one of the offer
+    swapC.accept_from_root(sp.record(offer = offers[2], proof = merkle_proof(levels, 1))).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+      now=sp.timestamp(0),
+      valid=False,
+      exception="The offer is not in the offer root"
+    )
+
+    # FAIL: the offer root has expired
+    swapC.accept_from_root(sp.record(offer = offers[2], proof = merkle_proof(levels, 2))).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+      now=sp.timestamp(100),
+      valid=False,
+      exception="The offer root has expired"
+    )
+
+    # alice accepts two offers of the collection
+    swapC.accept_from_root(sp.record(offer = offers[2], proof = merkle_proof(levels, 2))).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+      now=sp.timestamp(0),
+    )
+    swapC.accept_from_root(sp.record(offer = offers[4], proof = merkle_proof(levels, 4))).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+      now=sp.timestamp(0),
+    )
+
+    # verify the tokens swapped parties
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=2)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=sp.test_account("Alice").address, token_id=4)) == 1)
+    scenario.verify(fa2_1.get_balance(sp.record(owner=fa2_admin.address, token_id=5)) == 2)
+
+    # verify both offers are marked in the same bitmap entry
+    scenario.verify(swapC.data.spent_offers[sp.pair(levels[-1][0], 0)] == 20)
+
+    # FAIL: an offer can only be accepted once
+    swapC.accept_from_root(sp.record(offer = offers[2], proof = merkle_proof(levels, 2))).run(
+      sender=sp.test_account("Alice").address,
+      amount=sp.tez(1),
+      now=sp.timestamp(0),
+      valid=False,
+      exception="The offer was already accepted"
+    )